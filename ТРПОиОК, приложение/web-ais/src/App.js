@@ -1,7 +1,7 @@
 import React, { useState, useEffect } from 'react';
 import Login from './components/Login';
 import Dashboard from './components/Dashboard';
-import { isAuthenticated } from './services/auth';
+import { isAuthenticated, logout } from './services/auth';
 
 function App() {
   const [authenticated, setAuthenticated] = useState(false);
@@ -25,7 +25,7 @@ function App() {
 
   // Обработчик выхода
   const handleLogout = () => {
-    localStorage.removeItem('credentials');
+    logout();
     setAuthenticated(false);
   };
 
@@ -1,5 +1,5 @@
-import React, { useState } from 'react';
-import api from '../services/api';
+import React, { useState, useEffect } from 'react';
+import api, { subscribeLive } from '../services/api';
 import IndicationChart from './IndicationChart';
 
 const IndicationsWithChart = () => {
@@ -8,6 +8,18 @@ const IndicationsWithChart = () => {
   const [filterSensorId, setFilterSensorId] = useState('');
   const [sensorInfo, setSensorInfo] = useState(null);
   const [limitations, setLimitations] = useState(null);
+  const [liveSensorId, setLiveSensorId] = useState(null);
+
+  // Новые показания приходят по одному соединению вместо повторной загрузки всей истории
+  useEffect(() => {
+    if (!liveSensorId) return undefined;
+
+    return subscribeLive({ sensor_id: liveSensorId }, (type, data) => {
+      if (type === 'indication') {
+        setIndications((current) => [...current, data]);
+      }
+    });
+  }, [liveSensorId]);
 
   // Загрузка показаний
   const loadIndications = async (sensorId) => {
@@ -21,6 +33,7 @@ const IndicationsWithChart = () => {
       // Загружаем показания
       const response = await api.get(`/api/indication/sensor/${sensorId}`);
       setIndications(response.data);
+      setLiveSensorId(sensorId);
       
       // Загружаем информацию о датчике
       try {
@@ -42,6 +55,7 @@ const IndicationsWithChart = () => {
     } catch (error) {
       console.error('Ошибка загрузки показаний:', error);
       alert(`Ошибка: ${error.message}`);
+      setLiveSensorId(null);
       setIndications([]);
       setSensorInfo(null);
       setLimitations(null);
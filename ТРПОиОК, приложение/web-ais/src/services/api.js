@@ -1,4 +1,5 @@
 import axios from 'axios';
+import { getAuthorization, logout } from './auth';
 
 // Базовый URL вашего FastAPI-сервера
 const API_BASE_URL = 'http://127.0.0.1:8000';
@@ -12,12 +13,12 @@ const api = axios.create({
   }
 });
 
-// Перехватчик для добавления Basic Auth к каждому запросу
+// Перехватчик для добавления токена доступа к каждому запросу
 api.interceptors.request.use(
-  (config) => {
-    const credentials = localStorage.getItem('credentials');
-    if (credentials) {
-      config.headers.Authorization = `Basic ${credentials}`;
+  async (config) => {
+    const authorization = await getAuthorization();
+    if (authorization) {
+      config.headers.Authorization = authorization;
     }
     return config;
   },
@@ -62,7 +63,7 @@ api.interceptors.response.use(
       
       // Обработка 401 ошибки (неавторизован)
       if (error.response.status === 401) {
-        localStorage.removeItem('credentials');
+        logout();
         window.location.href = '/login';
       }
       
@@ -74,4 +75,55 @@ api.interceptors.response.use(
   }
 );
 
+// Подписка на поток новых показаний, смен статуса и событий (Server-Sent Events).
+// EventSource не умеет передавать заголовок Authorization, поэтому поток читается через fetch.
+// Токен проверяется только при подключении, поэтому его истечение не обрывает поток.
+// Возвращает функцию отписки.
+export const subscribeLive = (params, onMessage) => {
+  const controller = new AbortController();
+  const query = new URLSearchParams(params).toString();
+
+  const read = async () => {
+    const response = await fetch(`${API_BASE_URL}/api/live?${query}`, {
+      headers: {
+        'Authorization': await getAuthorization(),
+        'Accept': 'text/event-stream'
+      },
+      signal: controller.signal
+    });
+    if (!response.ok) {
+      throw new Error(`HTTP ${response.status}: ${response.statusText}`);
+    }
+
+    const reader = response.body.pipeThrough(new TextDecoderStream()).getReader();
+    let buffer = '';
+    while (true) {
+      const { value, done } = await reader.read();
+      if (done) break;
+
+      buffer += value;
+      const messages = buffer.split('\n\n');
+      buffer = messages.pop();
+
+      for (const message of messages) {
+        let type = 'message';
+        let data = null;
+        for (const line of message.split('\n')) {
+          if (line.startsWith('event: ')) type = line.slice(7);
+          if (line.startsWith('data: ')) data = JSON.parse(line.slice(6));
+        }
+        if (data) onMessage(type, data);
+      }
+    }
+  };
+
+  read().catch((error) => {
+    if (error.name !== 'AbortError') {
+      console.error('Ошибка потока показаний:', error);
+    }
+  });
+
+  return () => controller.abort();
+};
+
 export default api;
\ No newline at end of file
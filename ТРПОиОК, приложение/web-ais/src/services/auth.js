@@ -1,29 +1,49 @@
+const API_BASE_URL = 'http://127.0.0.1:8000';
+
+// Получение подписанного токена доступа по логину и паролю (Basic Auth).
+// Токен сохраняется вместе со временем, после которого его нужно обновить
+const requestToken = async (credentials) => {
+  const response = await fetch(`${API_BASE_URL}/api/login`, {
+    method: 'POST',
+    headers: {
+      'Authorization': `Basic ${credentials}`,
+      'Accept': 'application/json'
+    }
+  });
+
+  // Сервер без секрета подписи не выдает токены: учетные данные верны, запросы идут с Basic Auth
+  if (response.status === 503) {
+    localStorage.removeItem('token');
+    localStorage.setItem('token_expires', String(Date.now() + 5 * 60 * 1000));
+    return null;
+  }
+
+  if (!response.ok) {
+    throw new Error('Неверный логин или пароль');
+  }
+
+  const data = await response.json();
+  localStorage.setItem('token', data.access_token);
+  // Обновляем токен заранее, за минуту до истечения
+  localStorage.setItem('token_expires', String(Date.now() + (data.expires_in - 60) * 1000));
+  return data.access_token;
+};
+
 // Функция для входа в систему
 export const login = async (username, password) => {
   try {
     // Кодируем логин и пароль в Base64 для Basic Auth
     const credentials = btoa(`${username}:${password}`);
-    
-    // Сохраняем в localStorage для использования в interceptor
+
+    // Сохраняем в localStorage для обновления токена
     localStorage.setItem('credentials', credentials);
-    
-    // Тестовый запрос для проверки валидности учетных данных
-    const response = await fetch('http://127.0.0.1:8000/api/company', {
-      method: 'GET',
-      headers: {
-        'Authorization': `Basic ${credentials}`,
-        'Accept': 'application/json'
-      }
-    });
-    
-    if (!response.ok) {
-      localStorage.removeItem('credentials');
-      throw new Error('Неверный логин или пароль');
-    }
-    
+
+    // Проверка учетных данных и получение токена
+    await requestToken(credentials);
+
     return { success: true };
   } catch (error) {
-    localStorage.removeItem('credentials');
+    logout();
     throw error;
   }
 };
@@ -31,6 +51,8 @@ export const login = async (username, password) => {
 // Функция для выхода
 export const logout = () => {
   localStorage.removeItem('credentials');
+  localStorage.removeItem('token');
+  localStorage.removeItem('token_expires');
 };
 
 // Проверка авторизации
@@ -41,4 +63,26 @@ export const isAuthenticated = () => {
 // Получение текущих учетных данных
 export const getCredentials = () => {
   return localStorage.getItem('credentials');
-};
\ No newline at end of file
+};
+
+// Получение действующего токена; истекший токен обновляется по сохраненным учетным данным
+export const getToken = async () => {
+  const token = localStorage.getItem('token');
+  if (Date.now() < Number(localStorage.getItem('token_expires'))) {
+    return token;
+  }
+
+  const credentials = localStorage.getItem('credentials');
+  return credentials ? requestToken(credentials) : null;
+};
+
+// Заголовок Authorization: токен, а если сервер не выдает токены - Basic Auth
+export const getAuthorization = async () => {
+  const token = await getToken();
+  if (token) {
+    return `Bearer ${token}`;
+  }
+
+  const credentials = getCredentials();
+  return credentials ? `Basic ${credentials}` : null;
+};
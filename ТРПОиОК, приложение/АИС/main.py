@@ -1,20 +1,47 @@
 import uvicorn
+import settings
 from fastapi import FastAPI
+from contextlib import asynccontextmanager
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from services.database import engine, async_engine
 
 from routes.company_api import company_api
 from routes.room_api import room_api
 from routes.user_api import user_api
 from routes.sensor_api import sensor_api
 from routes.limitation_api import limitation_api
-from routes.monitoring_api import monitoring_api
+from routes.monitoring_api import monitoring_api, ingestion_queue, ingestion_executor, retention_worker
+
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if ingestion_queue is not None:
+        await ingestion_queue.start()
+    if retention_worker is not None:
+        retention_worker.start()
+
+    yield
+
+    if retention_worker is not None:
+        retention_worker.stop()
+    if ingestion_queue is not None:
+        await ingestion_queue.stop()
+    if ingestion_executor is not None:
+        ingestion_executor.shutdown()
+    if engine is not None:
+        engine.dispose()
+    if async_engine is not None:
+        await async_engine.dispose()
 
 
 
 app = FastAPI(
     title="Система контроля и управления датчиками",
     description="REST API для системы мониторинга помещений",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 
@@ -27,6 +54,8 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+app.add_middleware(GZipMiddleware, minimum_size=settings.HTTP_GZIP_MINIMUM_SIZE)
+
 
 app.include_router(company_api)
 app.include_router(room_api)
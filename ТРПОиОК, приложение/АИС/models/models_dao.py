@@ -1,6 +1,6 @@
 from datetime import datetime
 from sqlalchemy.orm import declarative_base, relationship
-from sqlalchemy import Column, Integer, Float, String, DateTime, Boolean, Enum, ForeignKey, UniqueConstraint
+from sqlalchemy import Column, Integer, Float, String, DateTime, Boolean, Enum, ForeignKey, UniqueConstraint, Index
 
 
 
@@ -45,13 +45,15 @@ class Room(Base):
 class User(Base):
     __tablename__ = 'user'
 
-    id            = Column(Integer,     primary_key=True,         autoincrement=True)
-    company_id    = Column(Integer,     ForeignKey('company.id'), nullable=False)
-    code          = Column(Integer,     nullable=False)
-    full_name     = Column(String(200), nullable=False)
-    role          = Column(Enum('Администратор', 'Оператор', 'Пользователь', name='user_roles'), nullable=False)
-    login         = Column(String(100), nullable=False,           unique=True)
-    password_hash = Column(String(255), nullable=False)
+    id                 = Column(Integer,     primary_key=True,         autoincrement=True)
+    company_id         = Column(Integer,     ForeignKey('company.id'), nullable=False)
+    code               = Column(Integer,     nullable=False)
+    full_name          = Column(String(200), nullable=False)
+    role               = Column(Enum('Администратор', 'Оператор', 'Пользователь', name='user_roles'), nullable=False)
+    login              = Column(String(100), nullable=False,           unique=True)
+    password_hash      = Column(String(255), nullable=False)
+    # Увеличивается при смене логина, пароля или роли и отзывает выданные токены
+    credential_version = Column(Integer,     nullable=False,           default=0, server_default='0')
 
     __table_args__ = (UniqueConstraint('company_id', 'code', name='unique_user'),)
 
@@ -71,9 +73,14 @@ class Sensor(Base):
     type    = Column(String(100), nullable=False)
     active  = Column(Boolean,     nullable=False,        default=True)
 
-    room       = relationship('Room',       back_populates='sensor')
-    indication = relationship('Indication', back_populates='sensor', cascade='all, delete-orphan')
-    event      = relationship('Event',      back_populates='sensor', cascade='all, delete-orphan')
+    __table_args__ = (Index('ix_sensor_room_id', 'room_id'),)
+
+    room              = relationship('Room',             back_populates='sensor')
+    indication        = relationship('Indication',       back_populates='sensor', cascade='all, delete-orphan')
+    indication_minute = relationship('IndicationMinute', back_populates='sensor', cascade='all, delete-orphan')
+    indication_hour   = relationship('IndicationHour',   back_populates='sensor', cascade='all, delete-orphan')
+    event             = relationship('Event',            back_populates='sensor', cascade='all, delete-orphan')
+    state             = relationship('SensorState',      back_populates='sensor', cascade='all, delete-orphan', uselist=False)
 
     def __repr__(self):
         return f"<Датчик(id={self.id}, Помещение={self.room_id}, Тип={self.type}, Активен={self.active})>"
@@ -104,6 +111,8 @@ class Indication(Base):
     value     = Column(Float,    nullable=False)
     status    = Column(Enum('Превышенное', 'Возможно превышение', 'Нормальное', name='indications_status'), nullable=False)
 
+    __table_args__ = (Index('ix_indication_time', 'time'),)
+
     sensor = relationship('Sensor', back_populates='indication')
 
     def __repr__(self):
@@ -112,6 +121,46 @@ class Indication(Base):
 
 
 
+class IndicationMinute(Base):
+    __tablename__ = 'indication_minute'
+
+    sensor_id = Column(Integer,  ForeignKey('sensor.id'), primary_key=True)
+    time      = Column(DateTime, primary_key=True)
+    min       = Column(Float,    nullable=False)
+    max       = Column(Float,    nullable=False)
+    sum       = Column(Float,    nullable=False)
+    count     = Column(Integer,  nullable=False)
+    exceeded  = Column(Integer,  nullable=False)
+    warned    = Column(Integer,  nullable=False)
+
+    sensor = relationship('Sensor', back_populates='indication_minute')
+
+    def __repr__(self):
+        return (f"<Показания за минуту(Датчик_id={self.sensor_id}, Время={self.time}, "
+                f"Минимум={self.min}, Максимум={self.max}, Количество={self.count}, Превышений={self.exceeded})>")
+
+
+
+class IndicationHour(Base):
+    __tablename__ = 'indication_hour'
+
+    sensor_id = Column(Integer,  ForeignKey('sensor.id'), primary_key=True)
+    time      = Column(DateTime, primary_key=True)
+    min       = Column(Float,    nullable=False)
+    max       = Column(Float,    nullable=False)
+    sum       = Column(Float,    nullable=False)
+    count     = Column(Integer,  nullable=False)
+    exceeded  = Column(Integer,  nullable=False)
+    warned    = Column(Integer,  nullable=False)
+
+    sensor = relationship('Sensor', back_populates='indication_hour')
+
+    def __repr__(self):
+        return (f"<Показания за час(Датчик_id={self.sensor_id}, Время={self.time}, "
+                f"Минимум={self.min}, Максимум={self.max}, Количество={self.count}, Превышений={self.exceeded})>")
+
+
+
 class Event(Base):
     __tablename__ = 'event'
 
@@ -125,3 +174,82 @@ class Event(Base):
     def __repr__(self):
         return (f"<Событие(Датчик_id={self.sensor_id}, Время={self.time}, "
                 f"Устранено={self.eliminated}, Описание={self.description})>")
+
+
+
+class SensorState(Base):
+    __tablename__ = 'sensor_state'
+
+    sensor_id  = Column(Integer,  ForeignKey('sensor.id'), primary_key=True)
+    time       = Column(DateTime, nullable=True)
+    value      = Column(Float,    nullable=True)
+    status     = Column(Enum('Превышенное', 'Возможно превышение', 'Нормальное', name='indications_status'), nullable=True)
+    prediction = Column(Float,    nullable=True)
+    open_event = Column(Boolean,  nullable=False,          default=False)
+    # Число записанных показаний датчика: по нему процессы узнают о чужих записях
+    sequence   = Column(Integer,  nullable=False,          default=0, server_default='0')
+
+    sensor = relationship('Sensor', back_populates='state')
+
+    def __repr__(self):
+        return (f"<Состояние датчика(Датчик_id={self.sensor_id}, Время={self.time}, Значение={self.value}, "
+                f"Статус={self.status}, Прогноз={self.prediction}, Открытое событие={self.open_event})>")
+
+
+
+class EntityVersion(Base):
+    __tablename__ = 'entity_version'
+
+    entity   = Column(String(20), primary_key=True)
+    scope_id = Column(Integer,    primary_key=True, autoincrement=False)
+    version  = Column(Integer,    nullable=False,   default=0)
+
+    def __repr__(self):
+        return f"<Версия списка(Сущность={self.entity}, Область={self.scope_id}, Версия={self.version})>"
+
+
+
+class ChangeLog(Base):
+    __tablename__ = 'change_log'
+
+    id         = Column(Integer,     primary_key=True, autoincrement=True)
+    company_id = Column(Integer,     nullable=False)
+    entity     = Column(Enum('company', 'room', 'user', 'sensor', 'limitation', 'event', name='change_entity'), nullable=False)
+    action     = Column(Enum('create', 'update', 'delete', name='change_action'), nullable=False)
+    key_id     = Column(Integer,     nullable=False)
+    key_text   = Column(String(100), nullable=True)
+    key_time   = Column(DateTime,    nullable=True)
+    time       = Column(DateTime,    nullable=False)
+
+    __table_args__ = (Index('ix_change_log_company_id', 'company_id', 'id'),)
+
+    def __repr__(self):
+        return (f"<Изменение(ID={self.id}, Компания_id={self.company_id}, Сущность={self.entity}, Действие={self.action}, "
+                f"Ключ={self.key_id}, {self.key_text}, {self.key_time}, Время={self.time})>")
+
+
+
+class JobRun(Base):
+    __tablename__ = 'job_run'
+
+    name     = Column(String(50),  primary_key=True)
+    process  = Column(String(100), nullable=False)
+    started  = Column(DateTime,    nullable=False)
+    finished = Column(DateTime,    nullable=False)
+    result   = Column(Integer,     nullable=False, default=0)
+
+    def __repr__(self):
+        return (f"<Выполнение задачи(Задача={self.name}, Процесс={self.process}, Начало={self.started}, "
+                f"Окончание={self.finished}, Результат={self.result})>")
+
+
+
+class SchemaVersion(Base):
+    __tablename__ = 'schema_version'
+
+    version     = Column(Integer,     primary_key=True, autoincrement=False)
+    description = Column(String(200), nullable=False)
+    applied     = Column(DateTime,    nullable=False)
+
+    def __repr__(self):
+        return f"<Версия схемы(Версия={self.version}, Описание={self.description}, Применена={self.applied})>"
@@ -1,7 +1,8 @@
-from typing import Optional
+from typing import Optional, List
 from datetime import datetime
-from pydantic import BaseModel
-from services.CRUD import UserRoles, IndicationStatuses
+from pydantic import BaseModel, field_validator
+from services.ingestion import to_local_time
+from services.CRUD import UserRoles, IndicationStatuses, ChangeEntities, ChangeActions
 
 
 
@@ -85,6 +86,12 @@ class UpdateUserDTO(BaseModel):
     password:  Optional[str]       = None
 
 
+class TokenDTO(BaseModel):
+    access_token: str
+    token_type:   str
+    expires_in:   int
+
+
 
 # Sensor #
 
@@ -141,11 +148,45 @@ class IndicationDTO(BaseModel):
         from_attributes = True
 
 
+class IndicationPageDTO(BaseModel):
+    items:       List[IndicationDTO]
+    next_cursor: Optional[datetime] = None
+
+
 class CreateIndicationDTO(BaseModel):
     sensor_id: int
     value:     float
 
 
+class BatchIndicationDTO(BaseModel):
+    sensor_id: int
+    value:     float
+    time:      Optional[datetime] = None
+
+    @field_validator('time')
+    @classmethod
+    def local_time(cls, time: Optional[datetime]) -> Optional[datetime]:
+        return to_local_time(time) if time is not None else None
+
+
+class BatchIndicationResultDTO(BaseModel):
+    sensor_id: int
+    time:      datetime
+    value:     float
+    accepted:  bool
+    status:    Optional[IndicationStatuses] = None
+    error:     Optional[str]                = None
+
+
+class IndicationAggregateDTO(BaseModel):
+    time:   datetime
+    min:    float
+    max:    float
+    avg:    float
+    count:  int
+    status: IndicationStatuses
+
+
 
 # Event #
 
@@ -159,6 +200,11 @@ class EventDTO(BaseModel):
         from_attributes = True
 
 
+class EventPageDTO(BaseModel):
+    items:       List[EventDTO]
+    next_cursor: Optional[datetime] = None
+
+
 class CreateEventDTO(BaseModel):
     sensor_id:   int
     eliminated:  bool = False
@@ -168,3 +214,59 @@ class CreateEventDTO(BaseModel):
 class UpdateEventDTO(BaseModel):
     eliminated:  Optional[bool] = None
     description: Optional[str]  = None
+
+
+
+# Sensor state #
+
+class SensorStateDTO(BaseModel):
+    sensor_id:  int
+    room_id:    int
+    company_id: int
+    type:       str
+    active:     bool
+    time:       Optional[datetime]           = None
+    value:      Optional[float]              = None
+    status:     Optional[IndicationStatuses] = None
+    prediction: Optional[float]              = None
+    open_event: bool
+
+
+
+# Dashboard #
+
+class SparklinePointDTO(BaseModel):
+    time:  datetime
+    value: float
+
+
+class RoomDashboardSensorDTO(BaseModel):
+    id:         int
+    type:       str
+    active:     bool
+    limitation: Optional[LimitationDTO] = None
+    last:       Optional[IndicationDTO] = None
+    open_event: Optional[EventDTO]      = None
+    sparkline:  List[SparklinePointDTO]
+
+
+class RoomDashboardDTO(BaseModel):
+    room:    RoomDTO
+    sensors: List[RoomDashboardSensorDTO]
+
+
+
+# Changes #
+
+class ChangeDTO(BaseModel):
+    version: int
+    entity:  ChangeEntities
+    action:  ChangeActions
+    key:     dict
+    data:    Optional[dict] = None
+
+
+class ChangesDTO(BaseModel):
+    version:  int
+    has_more: bool
+    changes:  List[ChangeDTO]
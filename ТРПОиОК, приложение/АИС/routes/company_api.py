@@ -1,9 +1,12 @@
 from services.CRUD import *
 from models.models_dto import *
-from fastapi.security import HTTPBasicCredentials
-from services.database import get_engine, get_session_fabric
-from fastapi import APIRouter, HTTPException, status, Response, Depends, Query
-from services.authorization import verify_user, security, level1, level2, level3
+from services.serialization import rows_response, dto_columns
+from services.cache import cached_response, user_scope, conditional_response, entity_etag
+from sqlalchemy.ext.asyncio import AsyncSession
+from fastapi.security import HTTPBasicCredentials, HTTPAuthorizationCredentials
+from services.database import get_db
+from fastapi import APIRouter, HTTPException, status, Response, Depends, Query, Request
+from services.authorization import authenticate, security, bearer, level1, level2, level3
 
 
 
@@ -11,48 +14,33 @@ company_api = APIRouter(prefix='/api', tags=['Company'])
 
 
 
-engine = get_engine()
-SessionLocal = get_session_fabric(engine)
-
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-        db.commit()
-    except:
-        db.rollback()
-        raise
-    finally:
-        db.close()
-
-
-
-def authorization(data: HTTPBasicCredentials = Depends(security), db: Session = Depends(get_db)) -> User:
-    return verify_user(data, db)
+async def authorization(data: HTTPBasicCredentials = Depends(security), token: HTTPAuthorizationCredentials = Depends(bearer),
+                        db: AsyncSession = Depends(get_db)) -> User:
+    return await authenticate(data, token, db)
 
 
 
 @company_api.post("/company", response_model=CompanyDTO, status_code=201)
-async def create_company_router(company: CreateCompanyDTO, user: User = Depends(authorization), db: Session = Depends(get_db)):
+async def create_company_router(company: CreateCompanyDTO, user: User = Depends(authorization), db: AsyncSession = Depends(get_db)):
     """Создание новой компании"""
     if user.role not in level1:
         raise HTTPException(403, f"Необходим уровень доступа: {level1}")
 
-    result = create_company(db, company.name, company.address)
+    result = await db.run_sync(create_company, company.name, company.address)
     if not result:
         raise HTTPException(400, "Не удалось создать компанию")
 
-    return db.query(Company).order_by(Company.id.desc()).first()
+    return await db.get(Company, result.id)
 
 
 
 @company_api.get("/company/{company_id}", response_model=CompanyDTO)
-async def get_company_by_id_router(company_id: int, user: User = Depends(authorization), db: Session = Depends(get_db)):
+async def get_company_by_id_router(company_id: int, user: User = Depends(authorization), db: AsyncSession = Depends(get_db)):
     """Получение компании по ID"""
     if user.role not in level3:
         raise HTTPException(403, f"Необходим уровень доступа: {level3}")
 
-    result = get_company_by_id(db, company_id)
+    result = await db.run_sync(get_company_by_id, company_id)
     if not result:
         raise HTTPException(404, f"Не удалось найти компанию с ID {company_id}")
 
@@ -61,17 +49,22 @@ async def get_company_by_id_router(company_id: int, user: User = Depends(authori
 
 
 @company_api.get("/company", response_model=List[CompanyDTO])
-async def get_companies_router(user: User = Depends(authorization), db: Session = Depends(get_db)):
+async def get_companies_router(request: Request, user: User = Depends(authorization), db: AsyncSession = Depends(get_db)):
     """Получение всех компаний"""
     if user.role not in level3:
         raise HTTPException(403, f"Необходим уровень доступа: {level3}")
 
-    return get_companies(db)
+    columns = dto_columns(CompanyDTO)
+    version = await db.run_sync(get_entity_version, 'company')
+    return await db.run_sync(lambda session: conditional_response(
+        request, entity_etag('company', 0, version),
+        lambda: cached_response(('/company', None, user_scope(user), version), [('company', 0)],
+                                lambda: rows_response(columns, get_company_rows(session, columns)))))
 
 
 
 @company_api.put("/company/{company_id}", response_model=CompanyDTO)
-async def update_company_router(company_id: int, company: UpdateCompanyDTO, user: User = Depends(authorization), db: Session = Depends(get_db)):
+async def update_company_router(company_id: int, company: UpdateCompanyDTO, user: User = Depends(authorization), db: AsyncSession = Depends(get_db)):
     """Обновление компании по ID"""
     if user.role not in level1:
         raise HTTPException(403, f"Необходим уровень доступа: {level1}")
@@ -79,21 +72,21 @@ async def update_company_router(company_id: int, company: UpdateCompanyDTO, user
     if company_id == 1:
         raise HTTPException(403, f"Нельзя изменять компанию с ID: 1")
 
-    result = get_company_by_id(db, company_id)
+    result = await db.run_sync(get_company_by_id, company_id)
     if not result:
         raise HTTPException(404, f"Не удалось найти компанию с ID {company_id}")
 
-    update = update_company(db, company_id, company.name, company.address)
+    update = await db.run_sync(update_company, company_id, company.name, company.address)
     if not update:
         raise HTTPException(400, f"Не удалось обновить компанию с ID {company_id}")
 
-    db.refresh(result)
+    await db.refresh(result)
     return result
 
 
 
 @company_api.delete("/company/{company_id}")
-async def delete_company_router(company_id: int, user: User = Depends(authorization), db: Session = Depends(get_db)):
+async def delete_company_router(company_id: int, user: User = Depends(authorization), db: AsyncSession = Depends(get_db)):
     """Удаление компании по ID"""
     if user.role not in level1:
         raise HTTPException(403, f"Необходим уровень доступа: {level1}")
@@ -101,11 +94,11 @@ async def delete_company_router(company_id: int, user: User = Depends(authorizat
     if company_id == 1:
         raise HTTPException(403, f"Нельзя удалять компанию с ID: 1")
 
-    result = get_company_by_id(db, company_id)
+    result = await db.run_sync(get_company_by_id, company_id)
     if not result:
         raise HTTPException(404, f"Не удалось найти компанию с ID {company_id}")
 
-    delete = delete_company(db, company_id)
+    delete = await db.run_sync(delete_company, company_id)
     if not delete:
         raise HTTPException(400, f"Не удалось удалить компанию с ID {company_id}")
 
@@ -1,9 +1,13 @@
 from services.CRUD import *
 from models.models_dto import *
-from fastapi.security import HTTPBasicCredentials
-from services.database import get_engine, get_session_fabric
-from fastapi import APIRouter, HTTPException, status, Response, Depends, Query
-from services.authorization import verify_user, security, level1, level2, level3
+from services.serialization import rows_response, dto_columns
+from services.cache import conditional_response, entity_etag
+from services.ownership import Ownership
+from sqlalchemy.ext.asyncio import AsyncSession
+from fastapi.security import HTTPBasicCredentials, HTTPAuthorizationCredentials
+from services.database import get_db
+from fastapi import APIRouter, HTTPException, status, Response, Depends, Query, Request
+from services.authorization import authenticate, security, bearer, level1, level2, level3
 
 
 
@@ -11,109 +15,118 @@ limitation_api = APIRouter(prefix='/api', tags=['Limitation'])
 
 
 
-engine = get_engine()
-SessionLocal = get_session_fabric(engine)
+async def authorization(data: HTTPBasicCredentials = Depends(security), token: HTTPAuthorizationCredentials = Depends(bearer),
+                        db: AsyncSession = Depends(get_db)) -> User:
+    return await authenticate(data, token, db)
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-        db.commit()
-    except:
-        db.rollback()
-        raise
-    finally:
-        db.close()
 
-
-
-def authorization(data: HTTPBasicCredentials = Depends(security), db: Session = Depends(get_db)) -> User:
-    return verify_user(data, db)
+def get_ownership(db: AsyncSession = Depends(get_db)) -> Ownership:
+    return Ownership(db)
 
 
 
 @limitation_api.post("/limitation", response_model=LimitationDTO, status_code=201)
-async def create_limitation_router(limitation: LimitationDTO, user: User = Depends(authorization), db: Session = Depends(get_db)):
+async def create_limitation_router(limitation: LimitationDTO, user: User = Depends(authorization), db: AsyncSession = Depends(get_db),
+                                   ownership: Ownership = Depends(get_ownership)):
     """Создание нового ограничения"""
-    if (user.role not in level1) and ((user.role not in level2) or (user.company_id != get_room_by_id(db, limitation.room_id).company_id)):
+    company_id = await ownership.room_company_id(limitation.room_id)
+    if company_id is None:
+        raise HTTPException(404, f"Не удалось найти помещение с ID {limitation.room_id}")
+
+    if (user.role not in level1) and ((user.role not in level2) or (user.company_id != company_id)):
         raise HTTPException(403, f"Необходимо:"
                                  f"\n- уровень доступа: {level1};"
-                                 f"\n- уровень доступа: {level2} и быть сотрудником компании: {get_room_by_id(db, limitation.room_id).company_id}")
+                                 f"\n- уровень доступа: {level2} и быть сотрудником компании: {company_id}")
 
-    result = create_limitation(db, limitation.type, limitation.room_id, limitation.max, limitation.min)
+    result = await db.run_sync(create_limitation, limitation.type, limitation.room_id, limitation.max, limitation.min)
     if not result:
         raise HTTPException(400, "Не удалось создать ограничение")
 
-    return get_limitation_by_pk(db, limitation.type, limitation.room_id)
+    return await db.run_sync(get_limitation_by_pk, limitation.type, limitation.room_id)
 
 
 
 @limitation_api.get("/limitation/room/{room_id}", response_model=List[LimitationDTO])
-async def get_limitations_by_room_id_router(room_id: int, user: User = Depends(authorization), db: Session = Depends(get_db)):
+async def get_limitations_by_room_id_router(room_id: int, request: Request, user: User = Depends(authorization), db: AsyncSession = Depends(get_db),
+                                            ownership: Ownership = Depends(get_ownership)):
     """Получение всех ограничений помещения"""
-    if (user.role not in level1) and ((user.role not in level3) or (user.company_id != get_room_by_id(db, room_id).company_id)):
+    company_id = await ownership.room_company_id(room_id)
+    if company_id is None:
+        raise HTTPException(404, f"Не удалось найти помещение с ID {room_id}")
+
+    if (user.role not in level1) and ((user.role not in level3) or (user.company_id != company_id)):
         raise HTTPException(403, f"Необходимо:"
                                  f"\n- уровень доступа: {level1};"
-                                 f"\n- уровень доступа: {level3} и быть сотрудником компании: {get_room_by_id(db, room_id).company_id}")
+                                 f"\n- уровень доступа: {level3} и быть сотрудником компании: {company_id}")
 
-    return get_limitations_by_room_id(db, room_id)
+    columns = dto_columns(LimitationDTO)
+    version = await db.run_sync(get_entity_version, 'limitation', room_id)
+    return await db.run_sync(lambda session: conditional_response(
+        request, entity_etag('limitation', room_id, version),
+        lambda: rows_response(columns, get_limitation_rows_by_room_id(session, room_id, columns))))
 
 
 
 
 @limitation_api.get("/limitation/{limitation_type}/{room_id}", response_model=LimitationDTO)
-async def get_limitation_by_pk_router(limitation_type: str, room_id: int, user: User = Depends(authorization), db: Session = Depends(get_db)):
+async def get_limitation_by_pk_router(limitation_type: str, room_id: int, user: User = Depends(authorization), db: AsyncSession = Depends(get_db),
+                                      ownership: Ownership = Depends(get_ownership)):
     """Получение ограничения по PK"""
     if user.role not in level3:
         raise HTTPException(403, f"Необходим уровень доступа: {level3}")
 
-    result = get_limitation_by_pk(db, limitation_type, room_id)
+    result = await db.run_sync(get_limitation_by_pk, limitation_type, room_id)
     if not result:
         raise HTTPException(404, f"Не удалось найти ограничение с PK: {limitation_type}, {room_id}")
 
-    if (user.role not in level1) and (user.company_id != get_room_by_id(db, result.room_id).company_id):
-        raise HTTPException(403, f"Необходимо быть сотрудником компании: {get_room_by_id(db, result.room_id).company_id}")
+    company_id = await ownership.room_company_id(result.room_id)
+    if (user.role not in level1) and (user.company_id != company_id):
+        raise HTTPException(403, f"Необходимо быть сотрудником компании: {company_id}")
 
     return result
 
 
 
 @limitation_api.put("/limitation/{limitation_type}/{room_id}", response_model=LimitationDTO)
-async def update_limitation_router(limitation_type: str, room_id: int, limitation: UpdateLimitationDTO, user: User = Depends(authorization), db: Session = Depends(get_db)):
+async def update_limitation_router(limitation_type: str, room_id: int, limitation: UpdateLimitationDTO, user: User = Depends(authorization), db: AsyncSession = Depends(get_db),
+                                   ownership: Ownership = Depends(get_ownership)):
     """Обновление ограничения по PK"""
     if user.role not in level2:
         raise HTTPException(403, f"Необходим уровень доступа: {level2}")
 
-    result = get_limitation_by_pk(db, limitation_type, room_id)
+    result = await db.run_sync(get_limitation_by_pk, limitation_type, room_id)
     if not result:
         raise HTTPException(404, f"Не удалось найти ограничение с PK: {limitation_type}, {room_id}")
 
-    if (user.role not in level1) and (user.company_id != get_room_by_id(db, result.room_id).company_id):
-        raise HTTPException(403, f"Необходимо быть сотрудником компании: {get_room_by_id(db, result.room_id).company_id}")
+    company_id = await ownership.room_company_id(result.room_id)
+    if (user.role not in level1) and (user.company_id != company_id):
+        raise HTTPException(403, f"Необходимо быть сотрудником компании: {company_id}")
 
-    update = update_limitation(db, limitation_type, room_id, limitation.max, limitation.min)
+    update = await db.run_sync(update_limitation, limitation_type, room_id, limitation.max, limitation.min)
     if not update:
         raise HTTPException(400, f"Не удалось обновить ограничение с PK: {limitation_type}, {room_id}")
 
-    db.refresh(result)
+    await db.refresh(result)
     return result
 
 
 
 @limitation_api.delete("/limitation/{limitation_type}/{room_id}")
-async def delete_limitation_router(limitation_type: str, room_id: int, user: User = Depends(authorization), db: Session = Depends(get_db)):
+async def delete_limitation_router(limitation_type: str, room_id: int, user: User = Depends(authorization), db: AsyncSession = Depends(get_db),
+                                   ownership: Ownership = Depends(get_ownership)):
     """Удаление ограничения по PK"""
     if user.role not in level2:
         raise HTTPException(403, f"Необходим уровень доступа: {level2}")
 
-    result = get_limitation_by_pk(db, limitation_type, room_id)
+    result = await db.run_sync(get_limitation_by_pk, limitation_type, room_id)
     if not result:
         raise HTTPException(404, f"Не удалось найти ограничение с PK: {limitation_type}, {room_id}")
 
-    if (user.role not in level1) and (user.company_id != get_room_by_id(db, result.room_id).company_id):
-        raise HTTPException(403, f"Необходимо быть сотрудником компании: {get_room_by_id(db, result.room_id).company_id}")
+    company_id = await ownership.room_company_id(result.room_id)
+    if (user.role not in level1) and (user.company_id != company_id):
+        raise HTTPException(403, f"Необходимо быть сотрудником компании: {company_id}")
 
-    delete = delete_limitation(db, limitation_type, room_id)
+    delete = await db.run_sync(delete_limitation, limitation_type, room_id)
     if not delete:
         raise HTTPException(400, f"Не удалось удалить ограничение с PK: {limitation_type}, {room_id}")
 
@@ -1,10 +1,27 @@
+import asyncio
+import settings
+import traceback
 from services.CRUD import *
 from models.models_dto import *
-from services.monitoring import MonitoringService
-from fastapi.security import HTTPBasicCredentials
-from services.database import get_engine, get_session_fabric
-from fastapi import APIRouter, HTTPException, status, Response, Depends, Query
-from services.authorization import verify_user, security, level1, level2, level3
+from services.serialization import rows_response, dto_columns
+from services.cache import sensor_cache, room_cache, response_cache, credential_cache, credential_versions
+from services.forecast import forecast_windows
+from services.ingestion import IngestionQueue, parse_text_frame, parse_binary_frame
+from services.sharding import ShardedExecutor
+from services.retention import RetentionWorker
+from services.rollup import ROLLUP_TIERS, select_tier
+from services.export import export_indications, ExportFormats, MEDIA_TYPES
+from services.live import live_hub, stream_messages
+from services.dashboard import get_room_dashboard
+from services.changes import get_changes_since
+from services.monitoring import MonitoringService, process_indication, process_batch
+from services.ownership import Ownership
+from sqlalchemy.ext.asyncio import AsyncSession
+from fastapi.security import HTTPBasicCredentials, HTTPAuthorizationCredentials
+from services.database import engine, SessionLocal, async_engine, AsyncSessionLocal, get_db, get_pool_stats
+from fastapi.responses import StreamingResponse
+from fastapi import APIRouter, HTTPException, status, Request, Response, Depends, Query, WebSocket, WebSocketDisconnect
+from services.authorization import authenticate, security, bearer, level1, level2, level3
 
 
 
@@ -12,70 +29,443 @@ monitoring_api = APIRouter(prefix='/api', tags=['Monitoring'])
 
 
 
-engine = get_engine()
-SessionLocal = get_session_fabric(engine)
-
-def get_db():
+def flush_indications(readings: List[dict]) -> List[dict]:
     db = SessionLocal()
     try:
-        yield db
-        db.commit()
-    except:
-        db.rollback()
-        raise
+        return MonitoringService(db).process_batch(readings)
     finally:
         db.close()
 
 
+ingestion_executor = None
+if settings.INGESTION_SHARDS > 0:
+    ingestion_executor = ShardedExecutor(flush_indications, settings.INGESTION_SHARDS)
+
+async def ingest(readings: List[dict]) -> List[dict]:
+    if ingestion_executor is not None:
+        return await ingestion_executor.run_async(readings)
+
+    async with AsyncSessionLocal() as db:
+        return await process_batch(db, readings)
+
+
+ingestion_queue = None
+if settings.INGESTION_MODE == 'queue':
+    # При шардировании пакеты передаются одним сборщиком, чтобы сохранить порядок показаний датчика
+    ingestion_queue = IngestionQueue(ingestion_executor.run if ingestion_executor else flush_indications,
+                                     settings.INGESTION_QUEUE_SIZE, settings.INGESTION_BATCH_SIZE,
+                                     settings.INGESTION_FLUSH_INTERVAL,
+                                     1 if ingestion_executor else settings.INGESTION_FLUSHERS)
+
+retention_worker = None
+if settings.RETENTION_ENABLED:
+    retention_worker = RetentionWorker(engine, settings.RETENTION_HOUR, settings.RETENTION_CHUNK_SIZE,
+                                       settings.RETENTION_PAUSE, settings.RETENTION_INTERVAL, ROLLUP_TIERS,
+                                       timedelta(days=settings.RETENTION_CHANGE_DAYS))
+
 
-def authorization(data: HTTPBasicCredentials = Depends(security), db: Session = Depends(get_db)) -> User:
-    return verify_user(data, db)
+
+async def authorization(data: HTTPBasicCredentials = Depends(security), token: HTTPAuthorizationCredentials = Depends(bearer),
+                        db: AsyncSession = Depends(get_db)) -> User:
+    return await authenticate(data, token, db)
+
+
+def get_ownership(db: AsyncSession = Depends(get_db)) -> Ownership:
+    return Ownership(db)
 
 
 
 @monitoring_api.post("/monitoring", status_code=201)
-async def create_indication_event_router(indication: CreateIndicationDTO, db: Session = Depends(get_db)):
+async def create_indication_event_router(indication: CreateIndicationDTO, response: Response, db: AsyncSession = Depends(get_db)):
     """Создание новых показаний и событий"""
-    monitoring_services = MonitoringService(db)
-    monitoring_services.process_indication(indication.sensor_id, indication.value)
+    if ingestion_queue is not None:
+        reading = {'sensor_id': indication.sensor_id, 'value': indication.value, 'time': datetime.now()}
+        if not ingestion_queue.put(reading):
+            raise HTTPException(503, "Очередь показаний переполнена, повторите запрос позже",
+                                headers={"Retry-After": str(settings.INGESTION_RETRY_AFTER)})
+
+        response.status_code = 202
+        return {"Сообщение": f"Показание {indication.value} датчика с ID {indication.sensor_id} принято в обработку"}
+
+    if ingestion_executor is not None:
+        await ingestion_executor.run_async([{'sensor_id': indication.sensor_id, 'value': indication.value}])
+    else:
+        await process_indication(db, indication.sensor_id, indication.value)
 
     return {"Сообщение": f"Датчик с ID {indication.sensor_id} получил показание {indication.value}"}
 
 
 
+@monitoring_api.post("/monitoring/batch", response_model=List[BatchIndicationResultDTO])
+async def create_indications_batch_router(indications: List[BatchIndicationDTO]):
+    """Пакетное создание показаний и событий"""
+    return await ingest([indication.model_dump() for indication in indications])
+
+
+
+@monitoring_api.websocket("/monitoring/stream")
+async def stream_indications_router(websocket: WebSocket):
+    """Потоковый прием показаний от шлюза"""
+    await websocket.accept()
+
+    # Кредит - число показаний, которые шлюз может отправить без подтверждения. Кадры читаются и подтверждаются
+    # независимо, кадр сверх остатка кредита отклоняется, подтверждение возвращает кредит его показаний
+    credit = settings.INGESTION_STREAM_WINDOW
+    frames = asyncio.Queue()
+    await websocket.send_json({"credit": credit})
+
+    async def acknowledge():
+        nonlocal credit
+        connected = True
+
+        while (frame := await frames.get()) is not None:
+            sequence, readings, errors = frame
+            if readings is None:
+                reply = {"sequence": sequence, "error": errors}
+            else:
+                valid = [reading for reading in readings if reading is not None]
+                try:
+                    results = iter(await ingest(valid) if valid else [])
+                except Exception:
+                    print(f'Исключение при записи кадра показаний: {traceback.format_exc()}')
+                    results = iter([{'accepted': False, 'error': "Не удалось сохранить кадр показаний"}] * len(valid))
+
+                statuses = []
+                for index, reading in enumerate(readings):
+                    result = next(results) if reading is not None else None
+                    statuses.append(result['status'] if result and result['accepted'] else None)
+                    if result and not result['accepted']:
+                        errors[index] = result['error']
+
+                credit += len(readings)
+                reply = {
+                    "sequence": sequence,
+                    "accepted": len(readings) - len(errors),
+                    "rejected": len(errors),
+                    "statuses": statuses,
+                    "errors": errors,
+                    "credit": len(readings)
+                }
+
+            # После отключения шлюза оставшиеся кадры записываются без подтверждений
+            if connected:
+                try:
+                    await websocket.send_json(reply)
+                except (WebSocketDisconnect, RuntimeError):
+                    connected = False
+
+    acknowledging = asyncio.create_task(acknowledge())
+
+    sequence = 0
+    try:
+        while True:
+            message = await websocket.receive()
+            if message['type'] == 'websocket.disconnect':
+                break
+
+            sequence += 1
+            try:
+                if message.get('bytes') is not None:
+                    readings, errors = parse_binary_frame(message['bytes'])
+                else:
+                    readings, errors = parse_text_frame(message.get('text') or '')
+
+                if len(readings) > credit:
+                    raise ValueError(f"Кадр содержит {len(readings)} показаний при остатке кредита {credit}")
+            except ValueError as e:
+                frames.put_nowait((sequence, None, str(e)))
+                continue
+
+            credit -= len(readings)
+            frames.put_nowait((sequence, readings, errors))
+
+    except WebSocketDisconnect:
+        pass
+
+    finally:
+        frames.put_nowait(None)
+        await acknowledging
+
+
+
+@monitoring_api.get("/live")
+async def live_router(request: Request, sensor_id: Optional[int] = None, room_id: Optional[int] = None,
+                      company_id: Optional[int] = None, data: HTTPBasicCredentials = Depends(security),
+                      token: HTTPAuthorizationCredentials = Depends(bearer)):
+    """Поток новых показаний, смен статуса и событий датчика, помещения или компании (Server-Sent Events)"""
+    scopes = [(scope, scope_id) for scope, scope_id in (('sensor', sensor_id), ('room', room_id), ('company', company_id))
+              if scope_id is not None]
+    if len(scopes) != 1:
+        raise HTTPException(400, "Необходимо указать ровно один из параметров: sensor_id, room_id, company_id")
+
+    # Пользователь и владелец читаются в отдельной сессии, которая закрывается до начала потока: сессия из get_db
+    # держала бы соединение пула все время, пока открыт поток
+    async with AsyncSessionLocal() as db:
+        user = await authenticate(data, token, db)
+        ownership = Ownership(db)
+
+        if sensor_id is not None:
+            company_id = await ownership.sensor_company_id(sensor_id)
+            if company_id is None:
+                raise HTTPException(404, f"Не удалось найти датчик с ID {sensor_id}")
+        elif room_id is not None:
+            company_id = await ownership.room_company_id(room_id)
+            if company_id is None:
+                raise HTTPException(404, f"Не удалось найти помещение с ID {room_id}")
+
+    # Права проверяются один раз при подключении
+    if (user.role not in level1) and ((user.role not in level3) or (user.company_id != company_id)):
+        raise HTTPException(403, f"Необходимо:"
+                                 f"\n- уровень доступа: {level1};"
+                                 f"\n- уровень доступа: {level3} и быть сотрудником компании: {company_id}")
+
+    subscription = live_hub.subscribe(*scopes[0])
+    return StreamingResponse(stream_messages(live_hub, subscription, request.is_disconnected, settings.LIVE_HEARTBEAT),
+                             media_type='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+
+@monitoring_api.get("/monitoring/stats")
+async def get_monitoring_stats_router(user: User = Depends(authorization), db: AsyncSession = Depends(get_db)):
+    """Получение статистики кэшей, окон прогноза, очереди, шардов, очистки показаний, подписок и пула соединений"""
+    if user.role not in level1:
+        raise HTTPException(403, f"Необходим уровень доступа: {level1}")
+
+    retention = None
+    if retention_worker is not None:
+        retention = {**retention_worker.stats(), "last_run": await db.run_sync(retention_worker.last_run)}
+
+    return {
+        "sensor_cache": sensor_cache.stats(),
+        "room_cache": room_cache.stats(),
+        "response_cache": response_cache.stats(),
+        "credential_cache": credential_cache.stats(),
+        "credential_versions": credential_versions.stats(),
+        "forecast_windows": forecast_windows.stats(),
+        "ingestion": ingestion_queue.stats() if ingestion_queue is not None else None,
+        "shards": ingestion_executor.stats() if ingestion_executor is not None else None,
+        "retention": retention,
+        "live": live_hub.stats(),
+        "database": {"requests": get_pool_stats(async_engine), "background": get_pool_stats(engine)}
+    }
+
+
+
+@monitoring_api.get("/indication/export")
+async def export_indications_router(sensor_id: Optional[int] = None, room_id: Optional[int] = None, company_id: Optional[int] = None,
+                                    time_from: Optional[datetime] = Query(None, alias="from"),
+                                    time_to: Optional[datetime] = Query(None, alias="to"),
+                                    export_format: ExportFormats = Query('ndjson', alias="format"), compress: bool = False,
+                                    user: User = Depends(authorization), db: AsyncSession = Depends(get_db),
+                                    ownership: Ownership = Depends(get_ownership)):
+    """Потоковая выгрузка показаний в NDJSON или CSV"""
+    owner_id = company_id
+    if sensor_id is not None:
+        owner_id = await ownership.sensor_company_id(sensor_id)
+        if owner_id is None:
+            raise HTTPException(404, f"Не удалось найти датчик с ID {sensor_id}")
+    elif room_id is not None:
+        owner_id = await ownership.room_company_id(room_id)
+        if owner_id is None:
+            raise HTTPException(404, f"Не удалось найти помещение с ID {room_id}")
+
+    if user.role not in level1:
+        if (user.role not in level3) or (owner_id is not None and user.company_id != owner_id):
+            raise HTTPException(403, f"Необходимо:"
+                                     f"\n- уровень доступа: {level1};"
+                                     f"\n- уровень доступа: {level3} и быть сотрудником компании: {owner_id}")
+        company_id = user.company_id
+
+    filters = {'sensor_id': sensor_id, 'room_id': room_id, 'company_id': company_id, 'time_from': time_from, 'time_to': time_to}
+    filename = f"indications.{export_format}" + (".gz" if compress else "")
+    headers = {'Content-Disposition': f'attachment; filename="{filename}"'}
+
+    return StreamingResponse(export_indications(SessionLocal, filters, export_format, compress),
+                             media_type='application/gzip' if compress else MEDIA_TYPES[export_format], headers=headers)
+
+
+
 @monitoring_api.get("/indication/sensor/{sensor_id}", response_model=List[IndicationDTO])
-async def get_indications_by_sensor_id_router(sensor_id: int, user: User = Depends(authorization), db: Session = Depends(get_db)):
+async def get_indications_by_sensor_id_router(sensor_id: int, user: User = Depends(authorization), db: AsyncSession = Depends(get_db),
+                                              ownership: Ownership = Depends(get_ownership)):
     """Получение всех показаний датчика"""
-    company_id = get_room_by_id(db, get_sensor_by_id(db, sensor_id).room_id).company_id
+    company_id = await ownership.sensor_company_id(sensor_id)
+    if company_id is None:
+        raise HTTPException(404, f"Не удалось найти датчик с ID {sensor_id}")
+
+    if (user.role not in level1) and ((user.role not in level3) or (user.company_id != company_id)):
+        raise HTTPException(403, f"Необходимо:"
+                                 f"\n- уровень доступа: {level1};"
+                                 f"\n- уровень доступа: {level3} и быть сотрудником компании: {company_id}")
+
+    columns = dto_columns(IndicationDTO)
+    return rows_response(columns, await db.run_sync(get_indication_rows_by_sensor_id, sensor_id, columns))
+
+
+
+@monitoring_api.get("/indication/sensor/{sensor_id}/page", response_model=IndicationPageDTO)
+async def get_indications_page_by_sensor_id_router(sensor_id: int, limit: int = Query(100, ge=1, le=PAGE_LIMIT),
+                                                   after: Optional[datetime] = None, before: Optional[datetime] = None,
+                                                   time_from: Optional[datetime] = Query(None, alias="from"),
+                                                   time_to: Optional[datetime] = Query(None, alias="to"),
+                                                   user: User = Depends(authorization), db: AsyncSession = Depends(get_db),
+                                                   ownership: Ownership = Depends(get_ownership)):
+    """Постраничное получение показаний датчика"""
+    company_id = await ownership.sensor_company_id(sensor_id)
+    if company_id is None:
+        raise HTTPException(404, f"Не удалось найти датчик с ID {sensor_id}")
+
+    if (user.role not in level1) and ((user.role not in level3) or (user.company_id != company_id)):
+        raise HTTPException(403, f"Необходимо:"
+                                 f"\n- уровень доступа: {level1};"
+                                 f"\n- уровень доступа: {level3} и быть сотрудником компании: {company_id}")
+
+    items, next_cursor = await db.run_sync(get_indications_page_by_sensor_id, sensor_id, limit, after, before, time_from, time_to)
+    return {'items': items, 'next_cursor': next_cursor}
+
+
+
+@monitoring_api.get("/indication/sensor/{sensor_id}/aggregate", response_model=List[IndicationAggregateDTO])
+async def get_indications_aggregate_by_sensor_id_router(sensor_id: int, time_from: Optional[datetime] = Query(None, alias="from"),
+                                                        time_to: Optional[datetime] = Query(None, alias="to"),
+                                                        bucket: IndicationBuckets = '1m',
+                                                        user: User = Depends(authorization), db: AsyncSession = Depends(get_db),
+                                                        ownership: Ownership = Depends(get_ownership)):
+    """Получение агрегированных по интервалам показаний датчика"""
+    company_id = await ownership.sensor_company_id(sensor_id)
+    if company_id is None:
+        raise HTTPException(404, f"Не удалось найти датчик с ID {sensor_id}")
+
+    if (user.role not in level1) and ((user.role not in level3) or (user.company_id != company_id)):
+        raise HTTPException(403, f"Необходимо:"
+                                 f"\n- уровень доступа: {level1};"
+                                 f"\n- уровень доступа: {level3} и быть сотрудником компании: {company_id}")
+
+    time_to = time_to or datetime.now()
+    time_from = time_from or time_to - timedelta(hours=24)
+    if time_from >= time_to:
+        raise HTTPException(400, "Начало периода должно быть раньше его окончания")
+    if (time_to - time_from).total_seconds() / BUCKET_SECONDS[bucket] > MAX_BUCKETS:
+        raise HTTPException(400, f"Период содержит больше {MAX_BUCKETS} интервалов, выберите более крупный интервал")
+
+    model = select_tier(BUCKET_SECONDS[bucket], time_from)
+    if model is Indication:
+        return await db.run_sync(get_indications_aggregate_by_sensor_id, sensor_id, time_from, time_to, bucket)
+    return await db.run_sync(get_rollups_aggregate_by_sensor_id, model, sensor_id, time_from, time_to, bucket)
+
+
+
+@monitoring_api.get("/state", response_model=List[SensorStateDTO])
+async def get_sensor_states_router(company_id: Optional[int] = None, room_id: Optional[int] = None,
+                                   user: User = Depends(authorization), db: AsyncSession = Depends(get_db),
+                                   ownership: Ownership = Depends(get_ownership)):
+    """Получение последнего известного состояния всех датчиков компании или помещения"""
+    owner_id = company_id
+    if room_id is not None:
+        owner_id = await ownership.room_company_id(room_id)
+        if owner_id is None:
+            raise HTTPException(404, f"Не удалось найти помещение с ID {room_id}")
+
+    if user.role not in level1:
+        if (user.role not in level3) or (owner_id is not None and user.company_id != owner_id):
+            raise HTTPException(403, f"Необходимо:"
+                                     f"\n- уровень доступа: {level1};"
+                                     f"\n- уровень доступа: {level3} и быть сотрудником компании: {owner_id}")
+        company_id = user.company_id
+
+    return await db.run_sync(get_sensor_states, company_id, room_id)
+
+
+
+@monitoring_api.get("/dashboard/room/{room_id}", response_model=RoomDashboardDTO)
+async def get_room_dashboard_router(room_id: int, user: User = Depends(authorization), db: AsyncSession = Depends(get_db),
+                                    ownership: Ownership = Depends(get_ownership)):
+    """Получение датчиков помещения с ограничениями, последними показаниями, открытыми событиями и графиком за час"""
+    company_id = await ownership.room_company_id(room_id)
+    if company_id is None:
+        raise HTTPException(404, f"Не удалось найти помещение с ID {room_id}")
 
     if (user.role not in level1) and ((user.role not in level3) or (user.company_id != company_id)):
         raise HTTPException(403, f"Необходимо:"
                                  f"\n- уровень доступа: {level1};"
                                  f"\n- уровень доступа: {level3} и быть сотрудником компании: {company_id}")
 
-    return get_indications_by_sensor_id(db, sensor_id)
+    room = await db.run_sync(get_room_by_id, room_id)
+    if not room:
+        raise HTTPException(404, f"Не удалось найти помещение с ID {room_id}")
+
+    return await db.run_sync(get_room_dashboard, room)
+
+
+
+@monitoring_api.get("/changes", response_model=ChangesDTO)
+async def get_changes_router(since: Optional[int] = Query(None, ge=0), company_id: Optional[int] = None,
+                             limit: int = Query(PAGE_LIMIT, ge=1, le=PAGE_LIMIT),
+                             user: User = Depends(authorization), db: AsyncSession = Depends(get_db)):
+    """Получение изменений сущностей после версии since (без since - только текущая версия)"""
+    if user.role not in level1:
+        if (user.role not in level3) or (company_id is not None and user.company_id != company_id):
+            raise HTTPException(403, f"Необходимо:"
+                                     f"\n- уровень доступа: {level1};"
+                                     f"\n- уровень доступа: {level3} и быть сотрудником компании: {company_id}")
+        company_id = user.company_id
+
+    if since is None:
+        return {'version': (await db.run_sync(get_change_id_range))[1], 'has_more': False, 'changes': []}
+
+    try:
+        return await db.run_sync(get_changes_since, since, company_id, limit)
+    except ValueError as e:
+        raise HTTPException(410, str(e))
 
 
 
 @monitoring_api.get("/event/sensor/{sensor_id}", response_model=List[EventDTO])
-async def get_events_by_sensor_id_router(sensor_id: int, user: User = Depends(authorization), db: Session = Depends(get_db)):
+async def get_events_by_sensor_id_router(sensor_id: int, user: User = Depends(authorization), db: AsyncSession = Depends(get_db),
+                                         ownership: Ownership = Depends(get_ownership)):
     """Получение всех событий датчика"""
-    company_id = get_room_by_id(db, get_sensor_by_id(db, sensor_id).room_id).company_id
+    company_id = await ownership.sensor_company_id(sensor_id)
+    if company_id is None:
+        raise HTTPException(404, f"Не удалось найти датчик с ID {sensor_id}")
+
+    if (user.role not in level1) and ((user.role not in level3) or (user.company_id != company_id)):
+        raise HTTPException(403, f"Необходимо:"
+                                 f"\n- уровень доступа: {level1};"
+                                 f"\n- уровень доступа: {level3} и быть сотрудником компании: {company_id}")
+
+    columns = dto_columns(EventDTO)
+    return rows_response(columns, await db.run_sync(get_event_rows_by_sensor_id, sensor_id, columns))
+
+
+
+@monitoring_api.get("/event/sensor/{sensor_id}/page", response_model=EventPageDTO)
+async def get_events_page_by_sensor_id_router(sensor_id: int, limit: int = Query(100, ge=1, le=PAGE_LIMIT),
+                                              after: Optional[datetime] = None, before: Optional[datetime] = None,
+                                              time_from: Optional[datetime] = Query(None, alias="from"),
+                                              time_to: Optional[datetime] = Query(None, alias="to"),
+                                              user: User = Depends(authorization), db: AsyncSession = Depends(get_db),
+                                              ownership: Ownership = Depends(get_ownership)):
+    """Постраничное получение событий датчика"""
+    company_id = await ownership.sensor_company_id(sensor_id)
+    if company_id is None:
+        raise HTTPException(404, f"Не удалось найти датчик с ID {sensor_id}")
 
     if (user.role not in level1) and ((user.role not in level3) or (user.company_id != company_id)):
         raise HTTPException(403, f"Необходимо:"
                                  f"\n- уровень доступа: {level1};"
                                  f"\n- уровень доступа: {level3} и быть сотрудником компании: {company_id}")
 
-    return get_events_by_sensor_id(db, sensor_id)
+    items, next_cursor = await db.run_sync(get_events_page_by_sensor_id, sensor_id, limit, after, before, time_from, time_to)
+    return {'items': items, 'next_cursor': next_cursor}
 
 
 
 @monitoring_api.put("/event/sensor/{sensor_id}", response_model=EventDTO)
-async def update_event_by_sensor_id_router(sensor_id: int, event: UpdateEventDTO, user: User = Depends(authorization), db: Session = Depends(get_db)):
+async def update_event_by_sensor_id_router(sensor_id: int, event: UpdateEventDTO, user: User = Depends(authorization), db: AsyncSession = Depends(get_db),
+                                           ownership: Ownership = Depends(get_ownership)):
     """Обновление события по PK"""
-    company_id = get_room_by_id(db, get_sensor_by_id(db, sensor_id).room_id).company_id
-    if not company_id:
+    company_id = await ownership.sensor_company_id(sensor_id)
+    if company_id is None:
         raise HTTPException(404, f"Не удалось найти датчик с ID {sensor_id}")
 
     if (user.role not in level1) and ((user.role not in level2) or (user.company_id != company_id)):
@@ -83,13 +473,13 @@ async def update_event_by_sensor_id_router(sensor_id: int, event: UpdateEventDTO
                                  f"\n- уровень доступа: {level1};"
                                  f"\n- уровень доступа: {level2} и быть сотрудником компании: {company_id}")
 
-    result = get_last_event_by_sensor_id(db, sensor_id)
+    result = await db.run_sync(get_last_event_by_sensor_id, sensor_id)
     if not result:
         raise HTTPException(404, f"Не удалось найти событие у датчика с ID {sensor_id}")
 
-    update = update_event(db, sensor_id, result.time, event.eliminated, event.description)
+    update = await db.run_sync(update_event, sensor_id, result.time, event.eliminated, event.description)
     if not update:
         raise HTTPException(400, f"Не удалось обновить событие у датчика с ID {sensor_id}")
 
-    db.refresh(result)
+    await db.refresh(result)
     return result
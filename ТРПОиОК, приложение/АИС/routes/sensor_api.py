@@ -1,9 +1,13 @@
 from services.CRUD import *
 from models.models_dto import *
-from fastapi.security import HTTPBasicCredentials
-from services.database import get_engine, get_session_fabric
-from fastapi import APIRouter, HTTPException, status, Response, Depends, Query
-from services.authorization import verify_user, security, level1, level2, level3
+from services.serialization import rows_response, dto_columns
+from services.cache import conditional_response, entity_etag
+from services.ownership import Ownership
+from sqlalchemy.ext.asyncio import AsyncSession
+from fastapi.security import HTTPBasicCredentials, HTTPAuthorizationCredentials
+from services.database import get_db
+from fastapi import APIRouter, HTTPException, status, Response, Depends, Query, Request
+from services.authorization import authenticate, security, bearer, level1, level2, level3
 
 
 
@@ -11,111 +15,127 @@ sensor_api = APIRouter(prefix='/api', tags=['Sensor'])
 
 
 
-engine = get_engine()
-SessionLocal = get_session_fabric(engine)
+async def authorization(data: HTTPBasicCredentials = Depends(security), token: HTTPAuthorizationCredentials = Depends(bearer),
+                        db: AsyncSession = Depends(get_db)) -> User:
+    return await authenticate(data, token, db)
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-        db.commit()
-    except:
-        db.rollback()
-        raise
-    finally:
-        db.close()
 
-
-
-def authorization(data: HTTPBasicCredentials = Depends(security), db: Session = Depends(get_db)) -> User:
-    return verify_user(data, db)
+def get_ownership(db: AsyncSession = Depends(get_db)) -> Ownership:
+    return Ownership(db)
 
 
 
 @sensor_api.post("/sensor", response_model=SensorDTO, status_code=201)
-async def create_sensor_router(sensor: CreateSensorDTO, user: User = Depends(authorization), db: Session = Depends(get_db)):
+async def create_sensor_router(sensor: CreateSensorDTO, user: User = Depends(authorization), db: AsyncSession = Depends(get_db),
+                               ownership: Ownership = Depends(get_ownership)):
     """Создание нового датчика"""
-    if (user.role not in level1) and ((user.role not in level2) or (user.company_id != get_room_by_id(db, sensor.room_id).company_id)):
+    company_id = await ownership.room_company_id(sensor.room_id)
+    if company_id is None:
+        raise HTTPException(404, f"Не удалось найти помещение с ID {sensor.room_id}")
+
+    if (user.role not in level1) and ((user.role not in level2) or (user.company_id != company_id)):
         raise HTTPException(403, f"Необходимо:"
                                  f"\n- уровень доступа: {level1};"
-                                 f"\n- уровень доступа: {level2} и быть сотрудником компании: {get_room_by_id(db, sensor.room_id).company_id}")
+                                 f"\n- уровень доступа: {level2} и быть сотрудником компании: {company_id}")
 
-    result = create_sensor(db, sensor.room_id, sensor.type, True)
+    result = await db.run_sync(create_sensor, sensor.room_id, sensor.type, True)
     if not result:
         raise HTTPException(400, "Не удалось создать датчик")
 
-    return db.query(Sensor).order_by(Sensor.id.desc()).first()
+    return await db.get(Sensor, result.id)
 
 
 
 @sensor_api.get("/sensor/{sensor_id}", response_model=SensorDTO)
-async def get_sensor_by_id_router(sensor_id: int, user: User = Depends(authorization), db: Session = Depends(get_db)):
+async def get_sensor_by_id_router(sensor_id: int, user: User = Depends(authorization), db: AsyncSession = Depends(get_db),
+                                  ownership: Ownership = Depends(get_ownership)):
     """Получение датчика по ID"""
     if user.role not in level3:
         raise HTTPException(403, f"Необходим уровень доступа: {level3}")
 
-    result = get_sensor_by_id(db, sensor_id)
+    result = await db.run_sync(get_sensor_by_id, sensor_id)
     if not result:
         raise HTTPException(404, f"Не удалось найти датчик с ID {sensor_id}")
 
-    if (user.role not in level1) and (user.company_id != get_room_by_id(db, result.room_id).company_id):
-        raise HTTPException(403, f"Необходимо быть сотрудником компании: {get_room_by_id(db, result.room_id).company_id}")
+    company_id = await ownership.room_company_id(result.room_id)
+    if (user.role not in level1) and (user.company_id != company_id):
+        raise HTTPException(403, f"Необходимо быть сотрудником компании: {company_id}")
 
     return result
 
 
 
 @sensor_api.get("/sensor/room/{room_id}", response_model=List[SensorDTO])
-async def get_sensors_by_room_id_router(room_id: int, user: User = Depends(authorization), db: Session = Depends(get_db)):
+async def get_sensors_by_room_id_router(room_id: int, request: Request, user: User = Depends(authorization), db: AsyncSession = Depends(get_db),
+                                        ownership: Ownership = Depends(get_ownership)):
     """Получение всех датчиков помещения"""
-    if (user.role not in level1) and ((user.role not in level3) or (user.company_id != get_room_by_id(db, room_id).company_id)):
+    company_id = await ownership.room_company_id(room_id)
+    if company_id is None:
+        raise HTTPException(404, f"Не удалось найти помещение с ID {room_id}")
+
+    if (user.role not in level1) and ((user.role not in level3) or (user.company_id != company_id)):
         raise HTTPException(403, f"Необходимо:"
                                  f"\n- уровень доступа: {level1};"
-                                 f"\n- уровень доступа: {level3} и быть сотрудником компании: {get_room_by_id(db, room_id).company_id}")
+                                 f"\n- уровень доступа: {level3} и быть сотрудником компании: {company_id}")
 
-    return get_sensors_by_room_id(db, room_id)
+    columns = dto_columns(SensorDTO)
+    version = await db.run_sync(get_entity_version, 'sensor', room_id)
+    return await db.run_sync(lambda session: conditional_response(
+        request, entity_etag('sensor', room_id, version),
+        lambda: rows_response(columns, get_sensor_rows_by_room_id(session, room_id, columns))))
 
 
 
 @sensor_api.put("/sensor/{sensor_id}", response_model=SensorDTO)
-async def update_sensor_router(sensor_id: int, sensor: UpdateSensorDTO, user: User = Depends(authorization), db: Session = Depends(get_db)):
+async def update_sensor_router(sensor_id: int, sensor: UpdateSensorDTO, user: User = Depends(authorization), db: AsyncSession = Depends(get_db),
+                               ownership: Ownership = Depends(get_ownership)):
     """Обновление датчика по ID"""
     if user.role not in level2:
         raise HTTPException(403, f"Необходим уровень доступа: {level2}")
 
-    result = get_sensor_by_id(db, sensor_id)
+    result = await db.run_sync(get_sensor_by_id, sensor_id)
     if not result:
         raise HTTPException(404, f"Не удалось найти датчик с ID {sensor_id}")
 
-    if (user.role not in level1) and (user.company_id != get_room_by_id(db, result.room_id).company_id):
-        raise HTTPException(403, f"Необходимо быть сотрудником компании: {get_room_by_id(db, result.room_id).company_id}")
+    # Текущее и новое помещения проверяются одним запросом
+    await ownership.load_rooms(*{result.room_id, sensor.room_id} - {None})
+    company_id = await ownership.room_company_id(result.room_id)
+    if (user.role not in level1) and (user.company_id != company_id):
+        raise HTTPException(403, f"Необходимо быть сотрудником компании: {company_id}")
+
+    if sensor.room_id is not None:
+        target_company_id = await ownership.room_company_id(sensor.room_id)
+        if target_company_id is None:
+            raise HTTPException(404, f"Не удалось найти помещение с ID {sensor.room_id}")
 
-    if get_room_by_id(db, sensor.room_id).company_id != get_room_by_id(db, result.room_id).company_id:
-        raise HTTPException(409, f"Нельзя менять помещения на те, которые не принадлежат компании с ID: {get_room_by_id(db, result.room_id).company_id}")
+        if target_company_id != company_id:
+            raise HTTPException(409, f"Нельзя менять помещения на те, которые не принадлежат компании с ID: {company_id}")
 
-    update = update_sensor(db, sensor_id, sensor.room_id, sensor.type, sensor.active)
+    update = await db.run_sync(update_sensor, sensor_id, sensor.room_id, sensor.type, sensor.active)
     if not update:
         raise HTTPException(400, f"Не удалось обновить датчик с ID {sensor_id}")
 
-    db.refresh(result)
+    await db.refresh(result)
     return result
 
 
 
 @sensor_api.delete("/sensor/{sensor_id}")
-async def delete_sensor_router(sensor_id: int, user: User = Depends(authorization), db: Session = Depends(get_db)):
+async def delete_sensor_router(sensor_id: int, user: User = Depends(authorization), db: AsyncSession = Depends(get_db),
+                               ownership: Ownership = Depends(get_ownership)):
     """Удаление датчика по ID"""
     if user.role not in level2:
         raise HTTPException(403, f"Необходим уровень доступа: {level2}")
 
-    result = get_sensor_by_id(db, sensor_id)
+    result = await db.run_sync(get_sensor_by_id, sensor_id)
     if not result:
         raise HTTPException(404, f"Не удалось найти датчик с ID {sensor_id}")
 
-    if (user.role not in level1) and (user.company_id != get_room_by_id(db, result.room_id).company_id):
-        raise HTTPException(403, f"Необходимо быть сотрудником компании: {get_room_by_id(db, result.room_id).company_id}")
+    company_id = await ownership.room_company_id(result.room_id)
+    if (user.role not in level1) and (user.company_id != company_id):
+        raise HTTPException(403, f"Необходимо быть сотрудником компании: {company_id}")
 
-    delete = delete_sensor(db, sensor_id)
+    delete = await db.run_sync(delete_sensor, sensor_id)
     if not delete:
         raise HTTPException(400, f"Не удалось удалить датчик с ID {sensor_id}")
 
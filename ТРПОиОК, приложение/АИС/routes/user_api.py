@@ -1,9 +1,12 @@
 from services.CRUD import *
 from models.models_dto import *
-from fastapi.security import HTTPBasicCredentials
-from services.database import get_engine, get_session_fabric
-from fastapi import APIRouter, HTTPException, status, Response, Depends, Query
-from services.authorization import verify_user, security, level1, level2, level3
+from services.serialization import rows_response, dto_columns
+from services.cache import cached_response, user_scope, conditional_response, entity_etag
+from sqlalchemy.ext.asyncio import AsyncSession
+from fastapi.security import HTTPBasicCredentials, HTTPAuthorizationCredentials
+from services.database import get_db
+from fastapi import APIRouter, HTTPException, status, Response, Depends, Query, Request
+from services.authorization import authenticate, issue_token, security, bearer, level1, level2, level3
 
 
 
@@ -11,29 +14,21 @@ user_api = APIRouter(prefix='/api', tags=['User'])
 
 
 
-engine = get_engine()
-SessionLocal = get_session_fabric(engine)
+async def authorization(data: HTTPBasicCredentials = Depends(security), token: HTTPAuthorizationCredentials = Depends(bearer),
+                        db: AsyncSession = Depends(get_db)) -> User:
+    return await authenticate(data, token, db)
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-        db.commit()
-    except:
-        db.rollback()
-        raise
-    finally:
-        db.close()
 
 
-
-def authorization(data: HTTPBasicCredentials = Depends(security), db: Session = Depends(get_db)) -> User:
-    return verify_user(data, db)
+@user_api.post("/login", response_model=TokenDTO)
+async def login_router(data: HTTPBasicCredentials = Depends(security), db: AsyncSession = Depends(get_db)):
+    """Получение подписанного токена доступа по логину и паролю"""
+    return issue_token(await authenticate(data, None, db))
 
 
 
 @user_api.post("/user", response_model=UserDTO, status_code=201)
-async def create_user_router(process_user: CreateUserDTO, user: User = Depends(authorization), db: Session = Depends(get_db)):
+async def create_user_router(process_user: CreateUserDTO, user: User = Depends(authorization), db: AsyncSession = Depends(get_db)):
     """Создание нового пользователя"""
     if (user.role not in level1) and ((user.role not in level2) or (user.company_id != process_user.company_id)):
         raise HTTPException(403, f"Необходимо:"
@@ -46,21 +41,21 @@ async def create_user_router(process_user: CreateUserDTO, user: User = Depends(a
     if process_user.role in level1:
         raise HTTPException(403, f"Нельзя создавать пользователя с уровнем: {level1}")
 
-    result = create_user(db, process_user.company_id, process_user.code, process_user.full_name, process_user.role, process_user.login, process_user.password)
+    result = await db.run_sync(create_user, process_user.company_id, process_user.code, process_user.full_name, process_user.role, process_user.login, process_user.password)
     if not result:
         raise HTTPException(400, "Не удалось создать пользователя")
 
-    return db.query(User).order_by(User.id.desc()).first()
+    return await db.get(User, result.id)
 
 
 
 @user_api.get("/user/{user_id}", response_model=UserDTO)
-async def get_user_by_id_router(user_id: int, user: User = Depends(authorization), db: Session = Depends(get_db)):
+async def get_user_by_id_router(user_id: int, user: User = Depends(authorization), db: AsyncSession = Depends(get_db)):
     """Получение пользователя по ID"""
     if user.role not in level3:
         raise HTTPException(403, f"Необходим уровень доступа: {level3}")
 
-    result = get_user_by_id(db, user_id)
+    result = await db.run_sync(get_user_by_id, user_id)
     if not result:
         raise HTTPException(404, f"Не удалось найти пользователя с ID {user_id}")
 
@@ -72,24 +67,29 @@ async def get_user_by_id_router(user_id: int, user: User = Depends(authorization
 
 
 @user_api.get("/user/company/{company_id}", response_model=List[UserDTO])
-async def get_users_by_company_id_router(company_id: int, user: User = Depends(authorization), db: Session = Depends(get_db)):
+async def get_users_by_company_id_router(company_id: int, request: Request, user: User = Depends(authorization), db: AsyncSession = Depends(get_db)):
     """Получение всех пользователей компаний"""
     if (user.role not in level1) and ((user.role not in level3) or (user.company_id != company_id)):
         raise HTTPException(403, f"Необходимо:"
                                  f"\n- уровень доступа: {level1};"
                                  f"\n- уровень доступа: {level3} и быть сотрудником компании: {company_id}")
 
-    return get_users_by_company_id(db, company_id)
+    columns = dto_columns(UserDTO)
+    version = await db.run_sync(get_entity_version, 'user', company_id)
+    return await db.run_sync(lambda session: conditional_response(
+        request, entity_etag('user', company_id, version),
+        lambda: cached_response(('/user/company', company_id, user_scope(user), version), [('user', company_id)],
+                                lambda: rows_response(columns, get_user_rows_by_company_id(session, company_id, columns)))))
 
 
 
 @user_api.put("/user/{user_id}", response_model=UserDTO)
-async def update_user_router(user_id: int, process_user: UpdateUserDTO, user: User = Depends(authorization), db: Session = Depends(get_db)):
+async def update_user_router(user_id: int, process_user: UpdateUserDTO, user: User = Depends(authorization), db: AsyncSession = Depends(get_db)):
     """Обновление пользователя по ID"""
     if user.role not in level2:
         raise HTTPException(403, f"Необходим уровень доступа: {level2}")
 
-    result = get_user_by_id(db, user_id)
+    result = await db.run_sync(get_user_by_id, user_id)
     if not result:
         raise HTTPException(404, f"Не удалось найти пользователя с ID {user_id}")
 
@@ -99,29 +99,29 @@ async def update_user_router(user_id: int, process_user: UpdateUserDTO, user: Us
     if process_user.role in level1:
         raise HTTPException(403, f"Нельзя создавать пользователя с уровнем: {level1}")
 
-    update = update_user(db, user_id, process_user.code, process_user.full_name, process_user.role, process_user.login, process_user.password)
+    update = await db.run_sync(update_user, user_id, process_user.code, process_user.full_name, process_user.role, process_user.login, process_user.password)
     if not update:
         raise HTTPException(400, f"Не удалось обновить пользователя с ID {user_id}")
 
-    db.refresh(result)
+    await db.refresh(result)
     return result
 
 
 
 @user_api.delete("/user/{user_id}")
-async def delete_user_router(user_id: int, user: User = Depends(authorization), db: Session = Depends(get_db)):
+async def delete_user_router(user_id: int, user: User = Depends(authorization), db: AsyncSession = Depends(get_db)):
     """Удаление пользователя по ID"""
     if user.role not in level2:
         raise HTTPException(403, f"Необходим уровень доступа: {level2}")
 
-    result = get_user_by_id(db, user_id)
+    result = await db.run_sync(get_user_by_id, user_id)
     if not result:
         raise HTTPException(404, f"Не удалось найти пользователя с ID {user_id}")
 
     if (user.role not in level1) and (user.company_id != result.company_id):
         raise HTTPException(403, f"Необходимо быть сотрудником компании: {result.company_id}")
 
-    delete = delete_user(db, user_id)
+    delete = await db.run_sync(delete_user, user_id)
     if not delete:
         raise HTTPException(400, f"Не удалось удалить пользователя с ID {user_id}")
 
@@ -1,20 +1,27 @@
 import hashlib
 import functools
 import traceback
+from sqlalchemy import insert, delete, and_, or_, func, case, cast, literal_column, tuple_, event
 from models.models_dao import *
 from sqlalchemy.orm import Session
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from services import cache
+from services.forecast import forecast_windows
 from datetime import datetime, timedelta
-from typing import Optional, List, Literal
+from typing import Optional, List, Literal, Tuple, Iterator, Callable, Any, Sequence, Union
 
 
 
 def dbexception(db_func):
     @functools.wraps(db_func)
-    def decorated_func(db: Session, *args, **kwargs) -> bool:
+    def decorated_func(db: Session, *args, **kwargs) -> Union[Base, bool]:
         try:
-            db_func(db, *args, **kwargs)
+            result = db_func(db, *args, **kwargs)
             db.commit()
-            return True
+            # Функции создания возвращают созданный объект, остальные - признак успеха
+            return result if isinstance(result, Base) else True
         except:
             print(f'Исключение в {db_func.__name__}: {traceback.format_exc()}')
             db.rollback()
@@ -22,12 +29,199 @@ def dbexception(db_func):
     return decorated_func
 
 
+def on_commit(db: Session, callback: Callable[[], Any]):
+    # Сброс кэшей выполняется после успешной фиксации: до commit параллельное чтение заполнило бы кэш старыми данными
+    db.info.setdefault('on_commit', []).append(callback)
+
+
+@event.listens_for(Session, 'after_commit')
+def run_on_commit(db: Session):
+    for callback in db.info.pop('on_commit', []):
+        callback()
+
+
+@event.listens_for(Session, 'after_rollback')
+def discard_on_commit(db: Session):
+    db.info.pop('on_commit', None)
+
+
+def get_columns(model, columns: Sequence[str]) -> list:
+    # Выборка только нужных столбцов кортежами, без построения ORM-объектов
+    return [getattr(model, column) for column in columns]
+
+
+PAGE_LIMIT = 1000
+
+def get_page_by_sensor_id(db: Session, model, sensor_id: int, limit: int, after: datetime = None, before: datetime = None,
+                          time_from: datetime = None, time_to: datetime = None) -> Tuple[list, Optional[datetime]]:
+    # Курсор - время последней выданной записи, выборка идет по первичному ключу (sensor_id, time) без OFFSET
+    query = db.query(model).filter(model.sensor_id == sensor_id)
+    if time_from is not None:
+        query = query.filter(model.time >= time_from)
+    if time_to is not None:
+        query = query.filter(model.time < time_to)
+    if after is not None:
+        query = query.filter(model.time > after)
+
+    if before is not None:
+        result = query.filter(model.time < before).order_by(model.time.desc()).limit(limit + 1).all()
+        items = result[:limit][::-1]
+        return items, (items[0].time if len(result) > limit else None)
+
+    result = query.order_by(model.time.asc()).limit(limit + 1).all()
+    items = result[:limit]
+    return items, (items[-1].time if len(result) > limit else None)
+
+
+
+def get_last_per_sensor(db: Session, model, room_id: int = None) -> list:
+    # Последняя запись каждого датчика (помещения) одним запросом через группировку по первичному ключу
+    last = db.query(model.sensor_id, func.max(model.time).label('time'))
+    if room_id is not None:
+        last = last.join(Sensor, Sensor.id == model.sensor_id).filter(Sensor.room_id == room_id)
+    last = last.group_by(model.sensor_id).subquery()
+
+    result = db.query(model).join(last, and_(model.sensor_id == last.c.sensor_id, model.time == last.c.time)).all()
+    return result
+
+
+
+def upsert(db: Session, model, rows: List[dict], keys: List[str], update: Callable[[Any], dict]):
+    # update получает вставляемую строку (inserted/excluded) и возвращает выражения для уже существующей
+    dialect = db.get_bind().dialect.name
+
+    if dialect == 'mysql':
+        statement = mysql_insert(model).values(rows)
+        # MySQL применяет присваивания слева направо, поэтому порядок выражений сохраняется
+        statement = statement.on_duplicate_key_update(list(update(statement.inserted).items()))
+    else:
+        statement = (sqlite_insert if dialect == 'sqlite' else postgresql_insert)(model).values(rows)
+        statement = statement.on_conflict_do_update(index_elements=keys, set_=update(statement.excluded))
+
+    db.execute(statement)
+
+
+def insert_ignore(db: Session, model, rows: List[dict], keys: List[str]):
+    # Строка с уже существующим ключом пропускается, остальные ошибки (внешние ключи, значения) не подавляются
+    dialect = db.get_bind().dialect.name
+
+    if dialect == 'mysql':
+        statement = mysql_insert(model).values(rows)
+        statement = statement.on_duplicate_key_update({keys[0]: statement.inserted[keys[0]]})
+    else:
+        statement = (sqlite_insert if dialect == 'sqlite' else postgresql_insert)(model).values(rows)
+        statement = statement.on_conflict_do_nothing(index_elements=keys)
+
+    db.execute(statement)
+
+
+
+# Entity version #
+
+def get_entity_version(db: Session, entity: str, scope_id: int = 0) -> int:
+    result = db.query(EntityVersion.version).filter(EntityVersion.entity == entity, EntityVersion.scope_id == scope_id).scalar()
+    return result or 0
+
+
+def mark_changed(db: Session, *tags: Tuple[str, int]):
+    # Метка (сущность, область) - список, который изменился: его версия увеличивается в той же транзакции. Версия входит
+    # в ключ кэша ответов, поэтому ответы прежней версии после commit только освобождают память
+    rows = [{'entity': entity, 'scope_id': scope_id, 'version': 1} for entity, scope_id in dict.fromkeys(tags)]
+    upsert(db, EntityVersion, rows, ['entity', 'scope_id'], lambda new: {'version': EntityVersion.version + 1})
+    on_commit(db, functools.partial(cache.invalidate_responses, *tags))
+
+
+
+# Change log #
+
+ChangeEntities = Literal['company', 'room', 'user', 'sensor', 'limitation', 'event']
+ChangeActions = Literal['create', 'update', 'delete']
+
+def log_changes(db: Session, entity: ChangeEntities, action: ChangeActions, keys: List[dict]):
+    # Ключ сущности: key_id - id (для ограничения room_id, для события sensor_id), key_text - тип ограничения,
+    # key_time - время события
+    if keys:
+        time = datetime.now()
+        first = allocate_change_ids(db, len(keys))
+        db.execute(insert(ChangeLog), [{'id': first + index, 'entity': entity, 'action': action, 'time': time, 'key_text': None,
+                                        'key_time': None, **key} for index, key in enumerate(keys)])
+
+
+def allocate_change_ids(db: Session, count: int) -> int:
+    # Версии журнала выдает счетчик в entity_version, а не автоинкремент: его строка заблокирована до конца транзакции,
+    # поэтому версии фиксируются строго по возрастанию и клиент не пропустит изменение, зафиксированное позже
+    upsert(db, EntityVersion, [{'entity': 'change_log', 'scope_id': 0, 'version': count}], ['entity', 'scope_id'],
+           lambda new: {'version': EntityVersion.version + new.version})
+    last = (db.query(EntityVersion.version).filter(EntityVersion.entity == 'change_log', EntityVersion.scope_id == 0).
+            with_for_update().scalar())
+    return last - count + 1
+
+
+def log_change(db: Session, company_id: int, entity: ChangeEntities, action: ChangeActions, key_id: int,
+               key_text: str = None, key_time: datetime = None):
+    log_changes(db, entity, action, [{'company_id': company_id, 'key_id': key_id, 'key_text': key_text, 'key_time': key_time}])
+
+
+def get_changes(db: Session, since: int, company_id: int = None, limit: int = PAGE_LIMIT) -> List[ChangeLog]:
+    # Компании видны всем пользователям, остальные сущности - только сотрудникам своей компании
+    result = db.query(ChangeLog).filter(ChangeLog.id > since)
+    if company_id is not None:
+        result = result.filter(or_(ChangeLog.company_id == company_id, ChangeLog.entity == 'company'))
+    return result.order_by(ChangeLog.id.asc()).limit(limit).all()
+
+
+def get_change_id_range(db: Session) -> Tuple[Optional[int], int]:
+    first, last = db.query(func.min(ChangeLog.id), func.max(ChangeLog.id)).one()
+    return first, last or 0
+
+
+@dbexception
+def delete_changes_by_less_time(db: Session, time: datetime) -> bool:
+    # Последняя запись сохраняется всегда: по ней клиент с устаревшей версией узнает, что журнал очищен
+    last = db.query(func.max(ChangeLog.id)).scalar()
+    if last is not None:
+        db.execute(delete(ChangeLog).where(ChangeLog.time < time, ChangeLog.id < last))
+
+
+def get_rows_by_keys(db: Session, model, key_columns: Sequence[str], keys: List[tuple], columns: Sequence[str]) -> List[tuple]:
+    if not keys:
+        return []
+
+    if len(key_columns) == 1:
+        condition = getattr(model, key_columns[0]).in_([key[0] for key in keys])
+    else:
+        condition = tuple_(*get_columns(model, key_columns)).in_(keys)
+
+    result = db.query(*get_columns(model, columns)).filter(condition).all()
+    return result
+
+
+
+# Job run #
+
+def get_job_run(db: Session, name: str) -> Optional[JobRun]:
+    result = db.query(JobRun).filter(JobRun.name == name).first()
+    return result
+
+
+@dbexception
+def record_job_run(db: Session, name: str, process: str, started: datetime, finished: datetime, result: int) -> bool:
+    # Хранится только последнее завершенное выполнение задачи любым процессом
+    upsert(db, JobRun, [{'name': name, 'process': process, 'started': started, 'finished': finished, 'result': result}], ['name'],
+           lambda new: {'process': new.process, 'started': new.started, 'finished': new.finished, 'result': new.result})
+
+
+
 # Company #
 
 @dbexception
-def create_company(db: Session, name: str, address: str) -> bool:
+def create_company(db: Session, name: str, address: str) -> Union[Company, bool]:
     company = Company(name=name, address=address)
     db.add(company)
+    db.flush()
+    mark_changed(db, ('company', 0))
+    log_change(db, company.id, 'company', 'create', company.id)
+    return company
 
 
 def get_company_by_id(db: Session, company_id: int) -> Optional[Company]:
@@ -40,6 +234,11 @@ def get_companies(db: Session) -> List[Company]:
     return result
 
 
+def get_company_rows(db: Session, columns: Sequence[str]) -> List[tuple]:
+    result = db.query(*get_columns(Company, columns)).order_by(Company.id.asc()).all()
+    return result
+
+
 @dbexception
 def update_company(db: Session, company_id: int, name: str = None, address: str = None) -> bool:
     company = get_company_by_id(db, company_id)
@@ -52,6 +251,8 @@ def update_company(db: Session, company_id: int, name: str = None, address: str
         company.name = name
     if address is not None:
         company.address = address
+    mark_changed(db, ('company', 0))
+    log_change(db, company_id, 'company', 'update', company_id)
 
 
 @dbexception
@@ -63,15 +264,25 @@ def delete_company(db: Session, company_id: int) -> bool:
         return False
 
     db.delete(company)
+    for user in company.user:
+        on_commit(db, functools.partial(cache.revoke_tokens, user.id))
+    on_commit(db, functools.partial(cache.invalidate_company, company_id))
+    on_commit(db, functools.partial(cache.invalidate_credentials, company_id=company_id))
+    mark_changed(db, ('company', 0), ('room', company_id), ('user', company_id))
+    log_change(db, company_id, 'company', 'delete', company_id)
 
 
 
 # Room #
 
 @dbexception
-def create_room(db: Session, company_id: int, number: int, name: str, description: str = None) -> bool:
+def create_room(db: Session, company_id: int, number: int, name: str, description: str = None) -> Union[Room, bool]:
     room = Room(company_id=company_id, number=number, name=name, description=description)
     db.add(room)
+    db.flush()
+    mark_changed(db, ('room', company_id))
+    log_change(db, company_id, 'room', 'create', room.id)
+    return room
 
 
 def get_room_by_id(db: Session, room_id: int) -> Optional[Room]:
@@ -79,11 +290,21 @@ def get_room_by_id(db: Session, room_id: int) -> Optional[Room]:
     return result
 
 
+def get_company_ids_by_room_ids(db: Session, room_ids: Sequence[int]) -> dict:
+    result = db.query(Room.id, Room.company_id).filter(Room.id.in_(set(room_ids))).all()
+    return dict(result)
+
+
 def get_rooms_by_company_id(db: Session, company_id: int) -> List[Room]:
     result = db.query(Room).filter(Room.company_id == company_id).all()
     return result
 
 
+def get_room_rows_by_company_id(db: Session, company_id: int, columns: Sequence[str]) -> List[tuple]:
+    result = db.query(*get_columns(Room, columns)).filter(Room.company_id == company_id).all()
+    return result
+
+
 @dbexception
 def update_room(db: Session, room_id: int, number: int = None, name: str = None, description: str = None) -> bool:
     room = get_room_by_id(db, room_id)
@@ -98,6 +319,8 @@ def update_room(db: Session, room_id: int, number: int = None, name: str = None,
         room.name = name
     if description is not None:
         room.description = description
+    mark_changed(db, ('room', room.company_id))
+    log_change(db, room.company_id, 'room', 'update', room_id)
 
 
 @dbexception
@@ -109,6 +332,9 @@ def delete_room(db: Session, room_id: int) -> bool:
         return False
 
     db.delete(room)
+    on_commit(db, functools.partial(cache.invalidate_room, room_id))
+    mark_changed(db, ('room', room.company_id), ('sensor', room_id), ('limitation', room_id))
+    log_change(db, room.company_id, 'room', 'delete', room_id)
 
 
 
@@ -117,10 +343,14 @@ def delete_room(db: Session, room_id: int) -> bool:
 UserRoles = Literal['Администратор', 'Оператор', 'Пользователь']
 
 @dbexception
-def create_user(db: Session, company_id: int, code: int, full_name: str, role: UserRoles, login: str, password: str) -> bool:
+def create_user(db: Session, company_id: int, code: int, full_name: str, role: UserRoles, login: str, password: str) -> Union[User, bool]:
     password_hash = hashlib.sha256(password.encode()).hexdigest()
     user = User(company_id=company_id, code=code, full_name=full_name, role=role, login=login, password_hash=password_hash)
     db.add(user)
+    db.flush()
+    mark_changed(db, ('user', company_id))
+    log_change(db, company_id, 'user', 'create', user.id)
+    return user
 
 
 def get_user_by_id(db: Session, user_id: int) -> Optional[User]:
@@ -133,11 +363,26 @@ def get_user_by_login(db: Session, login: str) -> Optional[User]:
     return result
 
 
+def get_credential_versions(db: Session) -> dict:
+    result = db.query(User.id, User.credential_version).all()
+    return dict(result)
+
+
+def get_credential_version(db: Session, user_id: int) -> Optional[int]:
+    result = db.query(User.credential_version).filter(User.id == user_id).scalar()
+    return result
+
+
 def get_users_by_company_id(db: Session, company_id: int) -> List[User]:
     result = db.query(User).filter(User.company_id == company_id).all()
     return result
 
 
+def get_user_rows_by_company_id(db: Session, company_id: int, columns: Sequence[str]) -> List[tuple]:
+    result = db.query(*get_columns(User, columns)).filter(User.company_id == company_id).all()
+    return result
+
+
 @dbexception
 def update_user(db: Session, user_id: int, code: int = None, full_name: str = None, role: UserRoles = None,
                 login: str = None, password: str = None) -> bool:
@@ -158,6 +403,13 @@ def update_user(db: Session, user_id: int, code: int = None, full_name: str = No
     if password is not None:
         user.password_hash = hashlib.sha256(password.encode()).hexdigest()
 
+    if role is not None or login is not None or password is not None:
+        user.credential_version += 1
+        on_commit(db, functools.partial(cache.revoke_tokens, user_id, user.credential_version))
+    on_commit(db, functools.partial(cache.invalidate_credentials, user_id=user_id))
+    mark_changed(db, ('user', user.company_id))
+    log_change(db, user.company_id, 'user', 'update', user_id)
+
 
 @dbexception
 def delete_user(db: Session, user_id: int) -> bool:
@@ -168,15 +420,24 @@ def delete_user(db: Session, user_id: int) -> bool:
         return False
 
     db.delete(user)
+    on_commit(db, functools.partial(cache.revoke_tokens, user_id))
+    on_commit(db, functools.partial(cache.invalidate_credentials, user_id=user_id))
+    mark_changed(db, ('user', user.company_id))
+    log_change(db, user.company_id, 'user', 'delete', user_id)
 
 
 
 # Sensor #
 
 @dbexception
-def create_sensor(db: Session, room_id: int, sensor_type: str, active: bool) -> bool:
+def create_sensor(db: Session, room_id: int, sensor_type: str, active: bool) -> Union[Sensor, bool]:
     sensor = Sensor(room_id=room_id, type=sensor_type, active=active)
     db.add(sensor)
+    db.flush()
+    on_commit(db, cache.invalidate_unknown_sensors)
+    mark_changed(db, ('sensor', room_id))
+    log_change(db, get_room_by_id(db, room_id).company_id, 'sensor', 'create', sensor.id)
+    return sensor
 
 
 def get_sensor_by_id(db: Session, sensor_id: int) -> Optional[Sensor]:
@@ -184,11 +445,55 @@ def get_sensor_by_id(db: Session, sensor_id: int) -> Optional[Sensor]:
     return result
 
 
+def get_sensor_ids(db: Session) -> List[int]:
+    result = db.query(Sensor.id).order_by(Sensor.id.asc()).all()
+    return [row.id for row in result]
+
+
 def get_sensors_by_room_id(db: Session, room_id: int) -> List[Sensor]:
     result = db.query(Sensor).filter(Sensor.room_id == room_id).all()
     return result
 
 
+def get_sensor_rows_by_room_id(db: Session, room_id: int, columns: Sequence[str]) -> List[tuple]:
+    result = db.query(*get_columns(Sensor, columns)).filter(Sensor.room_id == room_id).all()
+    return result
+
+
+def get_sensors_with_limitations_by_room_id(db: Session, room_id: int) -> List[tuple]:
+    result = (db.query(Sensor, Limitation).
+              outerjoin(Limitation, and_(Limitation.room_id == Sensor.room_id, Limitation.type == Sensor.type)).
+              filter(Sensor.room_id == room_id).order_by(Sensor.id).all())
+    return [tuple(row) for row in result]
+
+
+def get_sensor_metadata(db: Session, sensor_id: int) -> Optional[dict]:
+    result = (db.query(Sensor.id, Sensor.type, Sensor.room_id, Sensor.active, Room.company_id,
+                       Limitation.min, Limitation.max).
+              join(Room, Room.id == Sensor.room_id).
+              outerjoin(Limitation, and_(Limitation.room_id == Sensor.room_id, Limitation.type == Sensor.type)).
+              filter(Sensor.id == sensor_id).first())
+
+    if not result:
+        return None
+
+    return {
+        'id': result.id,
+        'type': result.type,
+        'room_id': result.room_id,
+        'company_id': result.company_id,
+        'active': result.active,
+        'limitation_min': result.min,
+        'limitation_max': result.max
+    }
+
+
+def get_company_ids_by_sensor_ids(db: Session, sensor_ids: Sequence[int]) -> dict:
+    result = (db.query(Sensor.id, Room.company_id).join(Room, Room.id == Sensor.room_id).
+              filter(Sensor.id.in_(set(sensor_ids))).all())
+    return dict(result)
+
+
 @dbexception
 def update_sensor(db: Session, sensor_id: int, room_id: int = None, sensor_type: str = None, active: bool = None) -> bool:
     sensor = get_sensor_by_id(db, sensor_id)
@@ -197,6 +502,8 @@ def update_sensor(db: Session, sensor_id: int, room_id: int = None, sensor_type:
         print(f'Предупреждение: датчик с ID {sensor_id} не найден')
         return False
 
+    mark_changed(db, ('sensor', sensor.room_id), ('sensor', room_id if room_id is not None else sensor.room_id))
+
     if room_id is not None:
         sensor.room_id = room_id
     if sensor_type is not None:
@@ -204,6 +511,9 @@ def update_sensor(db: Session, sensor_id: int, room_id: int = None, sensor_type:
     if active is not None:
         sensor.active = active
 
+    on_commit(db, functools.partial(cache.invalidate_sensor, sensor_id))
+    log_change(db, get_room_by_id(db, sensor.room_id).company_id, 'sensor', 'update', sensor_id)
+
 
 @dbexception
 def delete_sensor(db: Session, sensor_id: int) -> bool:
@@ -214,6 +524,10 @@ def delete_sensor(db: Session, sensor_id: int) -> bool:
         return False
 
     db.delete(sensor)
+    on_commit(db, functools.partial(cache.invalidate_sensor, sensor_id))
+    mark_changed(db, ('sensor', sensor.room_id))
+    log_change(db, get_room_by_id(db, sensor.room_id).company_id, 'sensor', 'delete', sensor_id)
+    on_commit(db, functools.partial(forecast_windows.invalidate, sensor_id))
 
 
 
@@ -228,6 +542,9 @@ def create_limitation(db: Session, limitation_type: str, room_id: int, limitatio
 
     limitation = Limitation(type=limitation_type, room_id=room_id, max=limitation_max, min=limitation_min)
     db.add(limitation)
+    on_commit(db, functools.partial(cache.invalidate_limitation, limitation_type, room_id))
+    mark_changed(db, ('limitation', room_id))
+    log_change(db, get_room_by_id(db, room_id).company_id, 'limitation', 'create', room_id, key_text=limitation_type)
 
 
 def get_limitation_by_pk(db: Session, limitation_type: str, room_id: int) -> Optional[Limitation]:
@@ -240,6 +557,11 @@ def get_limitations_by_room_id(db: Session, room_id: int) -> List[Limitation]:
     return result
 
 
+def get_limitation_rows_by_room_id(db: Session, room_id: int, columns: Sequence[str]) -> List[tuple]:
+    result = db.query(*get_columns(Limitation, columns)).filter(Limitation.room_id == room_id).all()
+    return result
+
+
 @dbexception
 def update_limitation(db: Session, limitation_type: str, room_id: int,
                       limitation_max: int = None, limitation_min: int = None) -> bool:
@@ -254,6 +576,10 @@ def update_limitation(db: Session, limitation_type: str, room_id: int,
     if limitation_min is not None:
         limitation.min = limitation_min
 
+    on_commit(db, functools.partial(cache.invalidate_limitation, limitation_type, room_id))
+    mark_changed(db, ('limitation', room_id))
+    log_change(db, get_room_by_id(db, room_id).company_id, 'limitation', 'update', room_id, key_text=limitation_type)
+
 
 @dbexception
 def delete_limitation(db: Session, limitation_type: str, room_id: int) -> bool:
@@ -264,6 +590,9 @@ def delete_limitation(db: Session, limitation_type: str, room_id: int) -> bool:
         return False
 
     db.delete(limitation)
+    on_commit(db, functools.partial(cache.invalidate_limitation, limitation_type, room_id))
+    mark_changed(db, ('limitation', room_id))
+    log_change(db, get_room_by_id(db, room_id).company_id, 'limitation', 'delete', room_id, key_text=limitation_type)
 
 
 
@@ -275,6 +604,89 @@ IndicationStatuses = Literal['Превышенное', 'Возможно пре
 def create_indication(db: Session, sensor_id: int, time: Optional[datetime], value: float, status: IndicationStatuses) -> bool:
     indication = Indication(sensor_id=sensor_id, time=(time if time else datetime.now()), value=value, status=status)
     db.add(indication)
+    update_rollups(db, [{'sensor_id': indication.sensor_id, 'time': indication.time, 'value': value, 'status': status}])
+    advance_sensor_sequences(db, [sensor_id])
+
+
+@dbexception
+def create_indications_and_events(db: Session, indications: List[dict], events: List[dict], states: List[dict] = None) -> bool:
+    if indications:
+        # Существующие показания отклоняются до записи, а повтор, записанный параллельно, не отменяет весь пакет
+        insert_ignore(db, Indication, indications, ['sensor_id', 'time'])
+        update_rollups(db, indications)
+        advance_sensor_sequences(db, [indication['sensor_id'] for indication in indications])
+    if events:
+        db.execute(insert(Event), events)
+        set_sensor_states_open_event(db, {event['sensor_id']: not event['eliminated'] for event in events})
+        log_events(db, 'create', events)
+    if states:
+        upsert_sensor_states(db, states)
+
+
+ROLLUPS = {IndicationMinute: 'minute', IndicationHour: 'hour'}
+
+def truncate_rollup_time(model, time: datetime) -> datetime:
+    # Начало интервала агрегата, в который попадает время
+    time = time.replace(second=0, microsecond=0)
+    if ROLLUPS[model] == 'hour':
+        time = time.replace(minute=0)
+    return time
+
+
+def summarize_indications(indications: List[dict], model) -> List[dict]:
+    rows = {}
+    for indication in indications:
+        time = truncate_rollup_time(model, indication['time'])
+
+        value = indication['value']
+        row = rows.get((indication['sensor_id'], time))
+        if row is None:
+            row = rows[(indication['sensor_id'], time)] = {'sensor_id': indication['sensor_id'], 'time': time, 'min': value,
+                                                           'max': value, 'sum': 0.0, 'count': 0, 'exceeded': 0, 'warned': 0}
+        row['min'] = min(row['min'], value)
+        row['max'] = max(row['max'], value)
+        row['sum'] += value
+        row['count'] += 1
+        row['exceeded'] += indication['status'] == 'Превышенное'
+        row['warned'] += indication['status'] == 'Возможно превышение'
+    return list(rows.values())
+
+
+def upsert_rollups(db: Session, model, rows: List[dict]):
+    # В SQLite min/max от двух аргументов - скалярные функции, в MySQL и PostgreSQL им соответствуют least/greatest
+    least, greatest = (func.min, func.max) if db.get_bind().dialect.name == 'sqlite' else (func.least, func.greatest)
+
+    upsert(db, model, rows, ['sensor_id', 'time'], lambda new: {
+        'min': least(model.min, new.min), 'max': greatest(model.max, new.max), 'sum': model.sum + new.sum,
+        'count': model.count + new.count, 'exceeded': model.exceeded + new.exceeded, 'warned': model.warned + new.warned})
+
+
+def update_rollups(db: Session, indications: List[dict]):
+    for model in ROLLUPS:
+        upsert_rollups(db, model, summarize_indications(indications, model))
+
+
+def get_last_indications_by_room_id(db: Session, room_id: int) -> List[Indication]:
+    return get_last_per_sensor(db, Indication, room_id)
+
+
+def get_rollup_points_by_room_id(db: Session, model, room_id: int, time: datetime) -> List[tuple]:
+    result = (db.query(model.sensor_id, model.time, (model.sum / model.count).label('value')).
+              join(Sensor, Sensor.id == model.sensor_id).filter(Sensor.room_id == room_id, model.time >= time).
+              order_by(model.sensor_id, model.time).all())
+    return [tuple(row) for row in result]
+
+
+def round_indication_time(db: Session, time: datetime) -> datetime:
+    # Время показания с точностью столбца: DATETIME в MySQL хранит целые секунды и округляет дробную часть
+    if db.get_bind().dialect.name == 'mysql':
+        return (time + timedelta(microseconds=500000)).replace(microsecond=0)
+    return time
+
+
+def get_existing_indication_keys(db: Session, keys: List[Tuple[int, datetime]]) -> set:
+    result = get_rows_by_keys(db, Indication, ['sensor_id', 'time'], list(set(keys)), ['sensor_id', 'time'])
+    return {(row.sensor_id, row.time) for row in result}
 
 
 def get_indication_by_pk(db: Session, sensor_id: int, time: datetime) -> Optional[Indication]:
@@ -287,6 +699,17 @@ def get_indications_by_sensor_id(db: Session, sensor_id: int) -> List[Indication
     return result
 
 
+def get_indication_rows_by_sensor_id(db: Session, sensor_id: int, columns: Sequence[str]) -> List[tuple]:
+    result = (db.query(*get_columns(Indication, columns)).filter(Indication.sensor_id == sensor_id).
+              order_by(Indication.time.asc()).all())
+    return result
+
+
+def get_indications_page_by_sensor_id(db: Session, sensor_id: int, limit: int, after: datetime = None, before: datetime = None,
+                                      time_from: datetime = None, time_to: datetime = None) -> Tuple[List[Indication], Optional[datetime]]:
+    return get_page_by_sensor_id(db, Indication, sensor_id, limit, after, before, time_from, time_to)
+
+
 def get_indications_by_sensor_id_and_more_hour(db: Session, sensor_id: int, hour: int) -> Optional[List]:
     required_time = datetime.now() - timedelta(hours=hour)
 
@@ -295,6 +718,106 @@ def get_indications_by_sensor_id_and_more_hour(db: Session, sensor_id: int, hour
     return result
 
 
+def get_indication_points_by_sensor_id_and_more_hour(db: Session, sensor_id: int, hour: int) -> List[tuple]:
+    required_time = datetime.now() - timedelta(hours=hour)
+
+    result = (db.query(Indication.time, Indication.value).filter(Indication.sensor_id == sensor_id, Indication.time >= required_time).
+              order_by(Indication.time.asc()).all())
+    return [tuple(row) for row in result]
+
+
+IndicationBuckets = Literal['1m', '5m', '1h', '1d']
+BUCKET_SECONDS = {'1m': 60, '5m': 300, '1h': 3600, '1d': 86400}
+BUCKET_ORIGIN = datetime(2000, 1, 1)
+MAX_BUCKETS = 10000
+
+def get_time_bucket(db: Session, column, seconds: int):
+    dialect = db.get_bind().dialect.name
+
+    if dialect == 'mysql':
+        offset = func.timestampdiff(literal_column('SECOND'), BUCKET_ORIGIN, column)
+    elif dialect == 'postgresql':
+        offset = cast(func.extract('epoch', column - BUCKET_ORIGIN), Integer)
+    else:
+        offset = cast(func.strftime('%s', column), Integer) - int((BUCKET_ORIGIN - datetime(1970, 1, 1)).total_seconds())
+
+    return offset // seconds
+
+
+def get_indications_aggregate_by_sensor_id(db: Session, sensor_id: int, time_from: datetime, time_to: datetime,
+                                           bucket: IndicationBuckets) -> List[dict]:
+    seconds = BUCKET_SECONDS[bucket]
+    number = get_time_bucket(db, Indication.time, seconds).label('number')
+    rank = case((Indication.status == 'Превышенное', 2), (Indication.status == 'Возможно превышение', 1), else_=0)
+
+    result = (db.query(number, func.min(Indication.value).label('min'), func.max(Indication.value).label('max'),
+                       func.avg(Indication.value).label('avg'), func.count().label('count'), func.max(rank).label('rank')).
+              filter(Indication.sensor_id == sensor_id, Indication.time >= time_from, Indication.time < time_to).
+              group_by(literal_column('number')).order_by(literal_column('number')).all())
+
+    statuses = ['Нормальное', 'Возможно превышение', 'Превышенное']
+    return [{
+        'time': BUCKET_ORIGIN + timedelta(seconds=row.number * seconds),
+        'min': row.min,
+        'max': row.max,
+        'avg': round(row.avg, 2),
+        'count': row.count,
+        'status': statuses[row.rank]
+    } for row in result]
+
+
+def iterate_indications(db: Session, sensor_id: int = None, room_id: int = None, company_id: int = None,
+                        time_from: datetime = None, time_to: datetime = None, chunk_size: int = 1000) -> Iterator[tuple]:
+    query = db.query(Indication.sensor_id, Indication.time, Indication.value, Indication.status)
+    if room_id is not None or company_id is not None:
+        query = query.join(Sensor, Sensor.id == Indication.sensor_id).join(Room, Room.id == Sensor.room_id)
+
+    if sensor_id is not None:
+        query = query.filter(Indication.sensor_id == sensor_id)
+    if room_id is not None:
+        query = query.filter(Sensor.room_id == room_id)
+    if company_id is not None:
+        query = query.filter(Room.company_id == company_id)
+    if time_from is not None:
+        query = query.filter(Indication.time >= time_from)
+    if time_to is not None:
+        query = query.filter(Indication.time < time_to)
+
+    # Строки читаются серверным курсором порциями, без загрузки всей выборки в память
+    query = query.order_by(Indication.sensor_id, Indication.time).execution_options(stream_results=True, yield_per=chunk_size)
+    for row in query:
+        yield tuple(row)
+
+
+def get_rollups_aggregate_by_sensor_id(db: Session, model, sensor_id: int, time_from: datetime, time_to: datetime,
+                                       bucket: IndicationBuckets) -> List[dict]:
+    seconds = BUCKET_SECONDS[bucket]
+    number = get_time_bucket(db, model.time, seconds).label('number')
+    # Строка агрегата помечена началом своего интервала: без округления начала периода вниз неполный первый интервал
+    # был бы потерян, а неполный последний и так входит целиком
+    time_from = truncate_rollup_time(model, time_from)
+
+    result = (db.query(number, func.min(model.min).label('min'), func.max(model.max).label('max'), func.sum(model.sum).label('sum'),
+                       func.sum(model.count).label('count'), func.sum(model.exceeded).label('exceeded'),
+                       func.sum(model.warned).label('warned')).
+              filter(model.sensor_id == sensor_id, model.time >= time_from, model.time < time_to).
+              group_by(literal_column('number')).order_by(literal_column('number')).all())
+
+    return [{
+        'time': BUCKET_ORIGIN + timedelta(seconds=row.number * seconds),
+        'min': row.min,
+        'max': row.max,
+        'avg': round(row.sum / row.count, 2),
+        'count': row.count,
+        'status': 'Превышенное' if row.exceeded else 'Возможно превышение' if row.warned else 'Нормальное'
+    } for row in result]
+
+
+@dbexception
+def delete_rollups_by_sensor_id_and_less_time(db: Session, model, sensor_id: int, time: datetime) -> bool:
+    db.query(model).filter(model.sensor_id == sensor_id, model.time < time).delete(synchronize_session=False)
+
+
 def get_indications_count_by_less_hour(db: Session, hour: int) -> int:
     required_time = datetime.now() - timedelta(hours=hour)
 
@@ -302,6 +825,12 @@ def get_indications_count_by_less_hour(db: Session, hour: int) -> int:
     return result
 
 
+def get_indication_times_by_sensor_id_and_less_time(db: Session, sensor_id: int, time: datetime, limit: int) -> List[datetime]:
+    result = (db.query(Indication.time).filter(Indication.sensor_id == sensor_id, Indication.time < time).
+              order_by(Indication.time.asc()).limit(limit).all())
+    return [row.time for row in result]
+
+
 @dbexception
 def delete_indication(db: Session, sensor_id: int, time: datetime) -> bool:
     indication = get_indication_by_pk(db, sensor_id, time)
@@ -311,6 +840,7 @@ def delete_indication(db: Session, sensor_id: int, time: datetime) -> bool:
         return False
 
     db.delete(indication)
+    forget_indications(db, [sensor_id])
 
 
 @dbexception
@@ -321,9 +851,22 @@ def delete_indications_by_less_hour(db: Session, hour: int) -> bool:
         print(f'Предупреждение: показания старше {required_time} не найдены')
         return False
 
+    if hour <= forecast_windows.hour:
+        sensor_ids = db.query(Indication.sensor_id).filter(Indication.time < required_time).distinct().all()
+        forget_indications(db, [row.sensor_id for row in sensor_ids])
+
     db.query(Indication).filter(Indication.time < required_time).delete()
 
 
+@dbexception
+def delete_indications_by_sensor_id_and_time_range(db: Session, sensor_id: int, first_time: datetime, last_time: datetime) -> bool:
+    (db.query(Indication).filter(Indication.sensor_id == sensor_id, Indication.time >= first_time, Indication.time <= last_time).
+     delete(synchronize_session=False))
+
+    if last_time >= datetime.now() - forecast_windows.period:
+        forget_indications(db, [sensor_id])
+
+
 
 
 # Event #
@@ -332,6 +875,8 @@ def delete_indications_by_less_hour(db: Session, hour: int) -> bool:
 def create_event(db: Session, sensor_id: int, eliminated: bool, description: str) -> bool:
     event = Event(sensor_id=sensor_id, time=datetime.now(), eliminated=eliminated, description=description)
     db.add(event)
+    refresh_sensor_state_open_event(db, sensor_id)
+    log_events(db, 'create', [{'sensor_id': sensor_id, 'time': event.time}])
 
 
 def get_event_by_pk(db: Session, sensor_id: int, time: datetime) -> Optional[Event]:
@@ -344,11 +889,36 @@ def get_last_event_by_sensor_id(db: Session, sensor_id: int) -> Optional[Event]:
     return result
 
 
+def get_last_events_by_room_id(db: Session, room_id: int) -> List[Event]:
+    return get_last_per_sensor(db, Event, room_id)
+
+
+def get_open_event_by_sensor_id(db: Session, sensor_id: int) -> Optional[Event]:
+    result = get_last_event_by_sensor_id(db, sensor_id)
+    return result if result and not result.eliminated else None
+
+
 def get_events_by_sensor_id(db: Session, sensor_id: int) -> List[Event]:
     result = db.query(Event).filter(Event.sensor_id == sensor_id).order_by(Event.time.asc()).all()
     return result
 
 
+def get_event_rows_by_sensor_id(db: Session, sensor_id: int, columns: Sequence[str]) -> List[tuple]:
+    result = db.query(*get_columns(Event, columns)).filter(Event.sensor_id == sensor_id).order_by(Event.time.asc()).all()
+    return result
+
+
+def get_events_page_by_sensor_id(db: Session, sensor_id: int, limit: int, after: datetime = None, before: datetime = None,
+                                 time_from: datetime = None, time_to: datetime = None) -> Tuple[List[Event], Optional[datetime]]:
+    return get_page_by_sensor_id(db, Event, sensor_id, limit, after, before, time_from, time_to)
+
+
+def log_events(db: Session, action: ChangeActions, events: List[dict]):
+    company_ids = get_company_ids_by_sensor_ids(db, [event['sensor_id'] for event in events])
+    log_changes(db, 'event', action, [{'company_id': company_ids[event['sensor_id']], 'key_id': event['sensor_id'],
+                                       'key_time': event['time']} for event in events if event['sensor_id'] in company_ids])
+
+
 @dbexception
 def update_event(db: Session, sensor_id: int, time: datetime, eliminated: bool = None, description: str = None) -> bool:
     event = get_event_by_pk(db, sensor_id, time)
@@ -362,6 +932,9 @@ def update_event(db: Session, sensor_id: int, time: datetime, eliminated: bool =
     if description is not None:
         event.description = description
 
+    refresh_sensor_state_open_event(db, sensor_id)
+    log_events(db, 'update', [{'sensor_id': sensor_id, 'time': time}])
+
 
 @dbexception
 def delete_event(db: Session, sensor_id: int, time: datetime) -> bool:
@@ -372,3 +945,83 @@ def delete_event(db: Session, sensor_id: int, time: datetime) -> bool:
         return False
 
     db.delete(event)
+    refresh_sensor_state_open_event(db, sensor_id)
+    log_events(db, 'delete', [{'sensor_id': sensor_id, 'time': time}])
+
+
+
+# Sensor state #
+
+def upsert_sensor_states(db: Session, states: List[dict]):
+    # Показание старше уже записанного не меняет состояние; time присваивается последним из-за порядка вычисления в MySQL
+    def update(new) -> dict:
+        newer = or_(SensorState.time.is_(None), new.time >= SensorState.time)
+        return {
+            'value': case((newer, new.value), else_=SensorState.value),
+            'status': case((newer, new.status), else_=SensorState.status),
+            'prediction': case((newer, new.prediction), else_=SensorState.prediction),
+            'time': case((newer, new.time), else_=SensorState.time)
+        }
+
+    upsert(db, SensorState, states, ['sensor_id'], update)
+
+
+def advance_sensor_sequences(db: Session, sensor_ids: List[int]):
+    # Счетчик увеличивается на число записанных показаний каждого датчика в той же транзакции
+    counts = {}
+    for sensor_id in sensor_ids:
+        counts[sensor_id] = counts.get(sensor_id, 0) + 1
+
+    upsert(db, SensorState, [{'sensor_id': sensor_id, 'sequence': count} for sensor_id, count in counts.items()],
+           ['sensor_id'], lambda new: {'sequence': SensorState.sequence + new.sequence})
+
+
+def forget_indications(db: Session, sensor_ids: Sequence[int]):
+    # Удаленные показания могут оставаться в окнах прогноза: счетчик датчика увеличивается в той же транзакции, поэтому
+    # окна всех процессов перестают совпадать с БД и загружаются заново, а окна этого процесса сбрасываются после commit
+    sensor_ids = set(sensor_ids)
+    if not sensor_ids:
+        return
+
+    advance_sensor_sequences(db, list(sensor_ids))
+    for sensor_id in sensor_ids:
+        on_commit(db, functools.partial(forecast_windows.invalidate, sensor_id))
+
+
+def lock_sensors(db: Session, sensor_ids: Sequence[int]):
+    # Блокировка строк датчиков до конца транзакции упорядочивает обработку показаний датчика между потоками и
+    # процессами; строки блокируются по возрастанию ID, поэтому пересекающиеся пакеты не взаимоблокируются
+    db.query(Sensor.id).filter(Sensor.id.in_(set(sensor_ids))).order_by(Sensor.id).with_for_update().all()
+
+
+def get_sensor_sequences(db: Session, sensor_ids: Sequence[int]) -> dict:
+    rows = db.query(SensorState.sensor_id, SensorState.sequence).filter(SensorState.sensor_id.in_(set(sensor_ids))).all()
+    return dict(rows)
+
+
+def set_sensor_states_open_event(db: Session, open_events: dict):
+    upsert(db, SensorState, [{'sensor_id': sensor_id, 'open_event': open_event} for sensor_id, open_event in open_events.items()],
+           ['sensor_id'], lambda new: {'open_event': new.open_event})
+
+
+def refresh_sensor_state_open_event(db: Session, sensor_id: int):
+    db.flush()
+    set_sensor_states_open_event(db, {sensor_id: get_open_event_by_sensor_id(db, sensor_id) is not None})
+
+
+def get_sensor_state_by_sensor_id(db: Session, sensor_id: int) -> Optional[SensorState]:
+    result = db.query(SensorState).filter(SensorState.sensor_id == sensor_id).first()
+    return result
+
+
+def get_sensor_states(db: Session, company_id: int = None, room_id: int = None) -> List[dict]:
+    query = (db.query(Sensor.id.label('sensor_id'), Sensor.room_id, Room.company_id, Sensor.type, Sensor.active,
+                      SensorState.time, SensorState.value, SensorState.status, SensorState.prediction, SensorState.open_event).
+             join(Room, Room.id == Sensor.room_id).outerjoin(SensorState, SensorState.sensor_id == Sensor.id))
+
+    if company_id is not None:
+        query = query.filter(Room.company_id == company_id)
+    if room_id is not None:
+        query = query.filter(Sensor.room_id == room_id)
+
+    return [{**row._asdict(), 'open_event': bool(row.open_event)} for row in query.order_by(Sensor.id).all()]
@@ -21,37 +21,45 @@ class AnalysisService:
             return False
 
 
-    def forecast(self, sensor_id: int, value: float) -> float:
-        indications = get_indications_by_sensor_id_and_more_hour(self.db, sensor_id, 3)
+    def forecast(self, sensor_id: int, value: float, sequence: int = None) -> float:
+        # sequence - текущий счетчик показаний датчика в БД; если он не передан, читается одним запросом
+        if sequence is None:
+            sequence = get_sensor_sequences(self.db, [sensor_id]).get(sensor_id, 0)
 
-        values = [i.value for i in indications]
-        values.append(value)
+        prediction = forecast_windows.predict(sensor_id, value, sequence)
 
-        if len(values) < 2:
-            return value
+        if prediction is None:
+            points = get_indication_points_by_sensor_id_and_more_hour(self.db, sensor_id, forecast_windows.hour)
+            forecast_windows.load(sensor_id, points, sequence)
+            prediction = forecast_windows.predict(sensor_id, value, sequence)
 
-        changes = []
-        for i in range(1, len(values)):
-            changes.append(values[i] - values[i - 1])
+        return prediction
 
-        avg_change = sum(changes) / len(changes)
 
-        return round(values[-1] + avg_change * 60, 2)
+    @staticmethod
+    def observe(sensor_id: int, time: datetime, value: float):
+        forecast_windows.append(sensor_id, time, value)
 
 
-    def analyze(self, sensor_id: int, value: float) -> dict:
-        sensor = get_sensor_by_id(self.db, sensor_id)
-        if not sensor:
+    def context(self, sensor_id: int) -> dict:
+        metadata = cache.sensor_cache.get(sensor_id)
+        if metadata is cache.MISSING:
+            metadata = get_sensor_metadata(self.db, sensor_id)
+            cache.sensor_cache.put(sensor_id, metadata)
+
+        if not metadata:
             raise ValueError(f"Датчик с ID {sensor_id} не найден")
 
-        limitation = get_limitation_by_pk(self.db, sensor.type, sensor.room_id)
-        if not limitation:
-            raise ValueError(f"Для датчика {sensor_id} (тип: {sensor.type}, помещение: {sensor.room_id}) не заданы ограничения")
+        if metadata['limitation_min'] is None:
+            raise ValueError(f"Для датчика {sensor_id} (тип: {metadata['type']}, помещение: {metadata['room_id']}) не заданы ограничения")
 
-        prediction = self.forecast(sensor_id, value)
+        return metadata
 
-        current_violation = (value < limitation.min or value > limitation.max)
-        prediction_violation = (prediction < limitation.min or prediction > limitation.max)
+
+    @staticmethod
+    def evaluate(metadata: dict, value: float, prediction: float) -> dict:
+        current_violation = (value < metadata['limitation_min'] or value > metadata['limitation_max'])
+        prediction_violation = (prediction < metadata['limitation_min'] or prediction > metadata['limitation_max'])
 
         if current_violation:
             status = 'Превышенное'
@@ -61,13 +69,21 @@ class AnalysisService:
             status = 'Нормальное'
 
         return {
-            'sensor_id': sensor_id,
+            'sensor_id': metadata['id'],
             'status': status,
             'value': round(value, 2),
             'prediction': prediction,
             'current_violation': current_violation,
             'prediction_violation': prediction_violation,
-            'limitation_min': limitation.min,
-            'limitation_max': limitation.max,
-            'sensor_type': sensor.type
+            'limitation_min': metadata['limitation_min'],
+            'limitation_max': metadata['limitation_max'],
+            'sensor_type': metadata['type']
         }
+
+
+    def analyze(self, sensor_id: int, value: float) -> dict:
+        metadata = self.context(sensor_id)
+
+        prediction = self.forecast(sensor_id, value)
+
+        return self.evaluate(metadata, value, prediction)
@@ -1,36 +1,115 @@
+import hmac
+import json
+import time
+import base64
 import hashlib
+import secrets
+import settings
+from typing import Optional
 from fastapi import HTTPException
 from models.models_dao import User
 from sqlalchemy.orm import Session
-from services.CRUD import get_user_by_login
-from services.database import get_session_fabric, get_engine
-from fastapi.security import HTTPBasic, HTTPBasicCredentials
+from sqlalchemy.ext.asyncio import AsyncSession
+from services.CRUD import get_user_by_login, get_credential_versions, get_credential_version
+from services.cache import credential_cache, credential_versions, MISSING
+from fastapi.security import HTTPBasic, HTTPBasicCredentials, HTTPBearer, HTTPAuthorizationCredentials
 
 
 
-engine = get_engine()
-SessionLocal = get_session_fabric(engine)
+security = HTTPBasic(auto_error=False)
+bearer = HTTPBearer(auto_error=False)
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
-
-
-security = HTTPBasic()
+# Ключ процесса для HMAC пароля в ключе кэша: пароль не хранится в памяти ни открытым, ни простым хэшем
+CREDENTIAL_KEY = secrets.token_bytes(32)
 
 def verify_user(data: HTTPBasicCredentials, db: Session) -> User:
+    key = (data.username, hmac.new(CREDENTIAL_KEY, data.password.encode(), hashlib.sha256).digest())
+    identity = credential_cache.get(key)
+    if identity is not MISSING:
+        # Маршрутам нужны только роль и компания, поэтому пользователь собирается без запроса к БД
+        return User(login=data.username, **identity)
+
     user = get_user_by_login(db, data.username)
     if not user or user.password_hash != hashlib.sha256(data.password.encode()).hexdigest():
         raise HTTPException(401, "Неверный логин или пароль")
 
+    credential_cache.put(key, {'id': user.id, 'role': user.role, 'company_id': user.company_id,
+                               'credential_version': user.credential_version})
     return user
 
 
 
+# Токен: base64url(JSON с id, ролью, компанией, версией учетных данных и сроком действия).base64url(HMAC-SHA256) #
+
+# Секрет общий для всех процессов: без него токены не выдаются и не принимаются, иначе токен одного процесса
+# отвергался бы остальными
+TOKEN_SECRET = settings.AUTH_SECRET.encode()
+
+def encode_base64(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode()
+
+
+def decode_base64(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
+
+
+def sign(payload: str) -> str:
+    return encode_base64(hmac.new(TOKEN_SECRET, payload.encode(), hashlib.sha256).digest())
+
+
+def issue_token(user: User, ttl: int = settings.AUTH_TOKEN_TTL) -> dict:
+    if not TOKEN_SECRET:
+        raise HTTPException(503, "Выдача токенов отключена: не задан секрет подписи [auth] secret")
+
+    claims = {'id': user.id, 'role': user.role, 'company_id': user.company_id,
+              'cv': user.credential_version or 0, 'exp': int(time.time()) + ttl}
+    payload = encode_base64(json.dumps(claims, separators=(',', ':')).encode())
+    return {'access_token': f'{payload}.{sign(payload)}', 'token_type': 'bearer', 'expires_in': ttl}
+
+
+def read_token(token: str) -> dict:
+    try:
+        payload, signature = token.split('.')
+        # Подпись сравнивается как байты: compare_digest не принимает строки с не-ASCII символами
+        if not TOKEN_SECRET or not hmac.compare_digest(signature.encode(), sign(payload).encode()):
+            raise ValueError
+        claims = json.loads(decode_base64(payload))
+    except ValueError:
+        raise HTTPException(401, "Недействительный токен", headers={'WWW-Authenticate': 'Bearer'})
+
+    if claims['exp'] < time.time():
+        raise HTTPException(401, "Срок действия токена истек", headers={'WWW-Authenticate': 'Bearer'})
+
+    return claims
+
+
+def token_user(claims: dict) -> User:
+    if not credential_versions.valid(claims['id'], claims['cv']):
+        raise HTTPException(401, "Токен отозван", headers={'WWW-Authenticate': 'Bearer'})
+
+    return User(id=claims['id'], role=claims['role'], company_id=claims['company_id'], credential_version=claims['cv'])
+
+
+def verify_token(token: str) -> User:
+    # Проверка без обращения к БД: подпись, срок действия и версия учетных данных из копии credential_versions
+    return token_user(read_token(token))
+
+
+async def authenticate(data: Optional[HTTPBasicCredentials], token: Optional[HTTPAuthorizationCredentials], db: AsyncSession) -> User:
+    if token is not None:
+        claims = read_token(token.credentials)
+        # К БД обращается только проверка токена, для которого устарела копия версий или которого в ней еще нет
+        if credential_versions.expired():
+            credential_versions.load(await db.run_sync(get_credential_versions))
+        elif not credential_versions.known(claims['id']):
+            credential_versions.put(claims['id'], await db.run_sync(get_credential_version, claims['id']))
+        return token_user(claims)
+    if data is not None:
+        return await db.run_sync(lambda session: verify_user(data, session))
+
+    raise HTTPException(401, "Необходима авторизация", headers={'WWW-Authenticate': 'Basic'})
+
+
 level1 = ["Администратор"]
 level2 = ["Администратор", "Оператор"]
 level3 = ["Администратор", "Оператор", "Пользователь"]
@@ -0,0 +1,282 @@
+import time
+import threading
+import settings
+from collections import OrderedDict
+from typing import Callable, Any, Iterable, Optional
+from fastapi import Request
+from fastapi.responses import Response
+
+
+
+MISSING = object()
+
+class LRUCache:
+    def __init__(self, size: int):
+        self.size = size
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+
+    def get(self, key, default=MISSING):
+        with self.lock:
+            if key not in self.items:
+                self.misses += 1
+                return default
+
+            self.items.move_to_end(key)
+            self.hits += 1
+            return self.items[key]
+
+
+    def put(self, key, value):
+        with self.lock:
+            self.items[key] = value
+            self.items.move_to_end(key)
+
+            while len(self.items) > self.size:
+                self.items.popitem(last=False)
+
+
+    def invalidate(self, key):
+        with self.lock:
+            self.items.pop(key, None)
+
+
+    def invalidate_if(self, predicate: Callable[[Any, Any], bool]):
+        with self.lock:
+            for key in [key for key, value in self.items.items() if predicate(key, value)]:
+                del self.items[key]
+
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+    def stats(self) -> dict:
+        with self.lock:
+            requests = self.hits + self.misses
+            return {
+                'size': len(self.items),
+                'max_size': self.size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / requests, 4) if requests else 0.0
+            }
+
+
+
+class TTLCache(LRUCache):
+    # Запись живет ttl секунд, истекшая запись считается промахом
+    def __init__(self, size: int, ttl: float):
+        super().__init__(size)
+        self.ttl = ttl
+
+
+    def get(self, key, default=MISSING):
+        with self.lock:
+            entry = self.items.get(key)
+            if entry is None or entry[1] < time.monotonic():
+                self.items.pop(key, None)
+                self.misses += 1
+                return default
+
+            self.items.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+
+    def put(self, key, value):
+        super().put(key, (value, time.monotonic() + self.ttl))
+
+
+    def invalidate_if(self, predicate: Callable[[Any, Any], bool]):
+        super().invalidate_if(lambda key, entry: predicate(key, entry[0]))
+
+
+    def stats(self) -> dict:
+        stats = super().stats()
+        stats['ttl'] = self.ttl
+        return stats
+
+
+
+class ResponseCache(TTLCache):
+    # Значение - тело ответа и метки, по которым ответ сбрасывается при изменении данных
+    def get(self, key, default=MISSING):
+        entry = super().get(key)
+        return default if entry is MISSING else entry[0]
+
+
+    def put(self, key, body: bytes, tags: Iterable = ()):
+        super().put(key, (body, frozenset(tags)))
+
+
+    def invalidate_tags(self, *tags):
+        tags = set(tags)
+        self.invalidate_if(lambda key, value: not tags.isdisjoint(value[1]))
+
+
+    def stats(self) -> dict:
+        stats = super().stats()
+        with self.lock:
+            stats['bytes'] = sum(len(value[0]) for value, _ in self.items.values())
+        return stats
+
+
+
+# Метаданные датчика (тип, помещение, активность, ограничение) или None для несуществующего датчика.
+# Сбрасываются после commit в процессе, который изменил данные; остальные процессы видят изменение по истечении ttl #
+
+sensor_cache = TTLCache(settings.SENSOR_CACHE_SIZE, settings.SENSOR_CACHE_TTL)
+
+def invalidate_sensor(sensor_id: int):
+    sensor_cache.invalidate(sensor_id)
+
+
+def invalidate_unknown_sensors():
+    sensor_cache.invalidate_if(lambda key, value: value is None)
+
+
+def invalidate_limitation(limitation_type: str, room_id: int):
+    sensor_cache.invalidate_if(lambda key, value: value is not None and
+                               value['room_id'] == room_id and value['type'] == limitation_type)
+
+
+def invalidate_room(room_id: int):
+    sensor_cache.invalidate_if(lambda key, value: value is not None and value['room_id'] == room_id)
+    room_cache.invalidate(room_id)
+
+
+def invalidate_company(company_id: int):
+    sensor_cache.invalidate_if(lambda key, value: value is not None and value['company_id'] == company_id)
+    room_cache.invalidate_if(lambda key, value: value == company_id)
+
+
+
+# Компания-владелец помещения. Помещение не переходит между компаниями, несуществующие помещения не кэшируются #
+
+room_cache = LRUCache(settings.ROOM_CACHE_SIZE)
+
+
+
+# Проверенные учетные данные: ключ - логин и HMAC пароля, значение - id, роль и компания пользователя #
+
+credential_cache = TTLCache(settings.CREDENTIAL_CACHE_SIZE, settings.CREDENTIAL_CACHE_TTL)
+
+def invalidate_credentials(user_id: int = None, company_id: int = None):
+    credential_cache.invalidate_if(lambda key, value: value['id'] == user_id or value['company_id'] == company_id)
+
+
+
+# Версии учетных данных пользователей для проверки токенов без обращения к БД: копия столбца user.credential_version,
+# которая перечитывается из БД, если старше refresh секунд. Изменения этого процесса применяются сразу после commit,
+# остальных - при следующем обновлении, поэтому отозванный в другом процессе токен принимается не дольше refresh секунд.
+# Пользователь, которого нет в копии, читается из БД отдельно; None - пользователь удален #
+
+class CredentialVersions:
+    def __init__(self, refresh: float):
+        self.refresh = refresh
+        self.versions = {}
+        self.loaded = None
+        self.lock = threading.Lock()
+        self.refreshes = 0
+
+
+    def expired(self) -> bool:
+        return self.loaded is None or time.monotonic() - self.loaded >= self.refresh
+
+
+    def load(self, versions: dict):
+        with self.lock:
+            self.versions = dict(versions)
+            self.loaded = time.monotonic()
+            self.refreshes += 1
+
+
+    def put(self, user_id: int, version: Optional[int]):
+        with self.lock:
+            self.versions[user_id] = version
+
+
+    def known(self, user_id: int) -> bool:
+        with self.lock:
+            return user_id in self.versions
+
+
+    def valid(self, user_id: int, version: int) -> bool:
+        with self.lock:
+            current = self.versions.get(user_id)
+            return current is not None and version >= current
+
+
+    def clear(self):
+        with self.lock:
+            self.versions = {}
+            self.loaded = None
+            self.refreshes = 0
+
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                'users': len(self.versions),
+                'refresh': self.refresh,
+                'refreshes': self.refreshes,
+                'age': round(time.monotonic() - self.loaded, 3) if self.loaded is not None else None
+            }
+
+
+credential_versions = CredentialVersions(settings.AUTH_REVOCATION_REFRESH)
+
+def revoke_tokens(user_id: int, version: Optional[int] = None):
+    # Без версии - пользователь удален, его токены отклоняются
+    credential_versions.put(user_id, version)
+
+
+
+# Тела ответов списков компаний, помещений и пользователей с метками ('company', 0), ('room', company_id), ('user', company_id) #
+
+response_cache = ResponseCache(settings.RESPONSE_CACHE_SIZE, settings.RESPONSE_CACHE_TTL)
+
+def user_scope(user) -> tuple:
+    return user.role, user.company_id
+
+
+def cached_response(key: tuple, tags: Iterable, build: Callable[[], Response]) -> Response:
+    body = response_cache.get(key)
+    if body is MISSING:
+        response = build()
+        response_cache.put(key, response.body, tags)
+        return response
+
+    return Response(content=body, media_type='application/json')
+
+
+def invalidate_responses(*tags):
+    response_cache.invalidate_tags(*tags)
+
+
+
+
+# Условные GET: ETag списка строится по его версии из entity_version, совпадение с If-None-Match дает 304 #
+
+def entity_etag(entity: str, scope_id: int, version: int) -> str:
+    return f'W/"{entity}-{scope_id}-{version}"'
+
+
+def conditional_response(request: Request, etag: str, build: Callable[[], Response]) -> Response:
+    headers = {'ETag': etag, 'Cache-Control': 'private, no-cache'}
+
+    # Слабое сравнение: префикс W/ не учитывается
+    tags = [tag.strip().removeprefix('W/') for tag in request.headers.get('if-none-match', '').split(',')]
+    if '*' in tags or etag.removeprefix('W/') in tags:
+        return Response(status_code=304, headers=headers)
+
+    response = build()
+    response.headers.update(headers)
+    return response
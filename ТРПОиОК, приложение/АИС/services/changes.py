@@ -0,0 +1,70 @@
+from services.CRUD import *
+from services.serialization import dto_columns
+from models.models_dto import CompanyDTO, RoomDTO, UserDTO, SensorDTO, LimitationDTO, EventDTO
+
+
+
+# Модель, DTO и столбцы ключа каждой сущности журнала изменений #
+
+CHANGE_ENTITIES = {
+    'company':    (Company,    CompanyDTO,    ('id',)),
+    'room':       (Room,       RoomDTO,       ('id',)),
+    'user':       (User,       UserDTO,       ('id',)),
+    'sensor':     (Sensor,     SensorDTO,     ('id',)),
+    'limitation': (Limitation, LimitationDTO, ('type', 'room_id')),
+    'event':      (Event,      EventDTO,      ('sensor_id', 'time')),
+}
+
+
+
+def get_change_key(change: ChangeLog) -> tuple:
+    if change.entity == 'limitation':
+        return change.key_text, change.key_id
+    if change.entity == 'event':
+        return change.key_id, change.key_time
+    return change.key_id,
+
+
+def get_changes_since(db: Session, since: int, company_id: int = None, limit: int = PAGE_LIMIT) -> dict:
+    # Удаление компании или помещения удаляет и дочерние сущности: отдельные записи о них не пишутся
+    first, last = get_change_id_range(db)
+    if first is not None and since < first - 1:
+        raise ValueError(f"Изменения до версии {first} уже удалены, требуется полная загрузка")
+
+    changes = get_changes(db, since, company_id, limit)
+
+    # По каждой сущности остается только последнее изменение
+    latest = {}
+    for change in changes:
+        key = (change.entity, get_change_key(change))
+        latest.pop(key, None)
+        latest[key] = change
+
+    # Текущие данные читаются одним запросом на тип сущности
+    data = {}
+    for entity, (model, dto, key_columns) in CHANGE_ENTITIES.items():
+        keys = [key for (change_entity, key), change in latest.items() if change_entity == entity and change.action != 'delete']
+        columns = dto_columns(dto)
+        positions = [columns.index(column) for column in key_columns]
+        for row in get_rows_by_keys(db, model, key_columns, keys, columns):
+            data[(entity, tuple(row[position] for position in positions))] = dict(zip(columns, row))
+
+    items = []
+    for (entity, key), change in latest.items():
+        row = data.get((entity, key))
+        items.append({
+            'version': change.id,
+            'entity': entity,
+            # Сущность, удаленная вместе с родителем после записи изменения, тоже отдается как удаленная
+            'action': change.action if row is not None or change.action == 'delete' else 'delete',
+            'key': dict(zip(CHANGE_ENTITIES[entity][2], key)),
+            'data': row
+        })
+
+    # Без продолжения версия сдвигается до последней записи журнала: чужие изменения не просматриваются повторно
+    has_more = len(changes) == limit
+    return {
+        'version': changes[-1].id if has_more else max(since, last),
+        'has_more': has_more,
+        'changes': items
+    }
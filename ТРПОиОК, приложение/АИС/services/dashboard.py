@@ -0,0 +1,29 @@
+from services.CRUD import *
+
+
+
+SPARKLINE_MINUTES = 60
+
+def get_room_dashboard(db: Session, room: Room) -> dict:
+    # Число запросов не зависит от числа датчиков: каждая часть читается одним запросом на всё помещение
+    sensors = get_sensors_with_limitations_by_room_id(db, room.id)
+    last_indications = {indication.sensor_id: indication for indication in get_last_indications_by_room_id(db, room.id)}
+    open_events = {event.sensor_id: event for event in get_last_events_by_room_id(db, room.id) if not event.eliminated}
+
+    sparklines = {}
+    required_time = datetime.now().replace(second=0, microsecond=0) - timedelta(minutes=SPARKLINE_MINUTES)
+    for sensor_id, time, value in get_rollup_points_by_room_id(db, IndicationMinute, room.id, required_time):
+        sparklines.setdefault(sensor_id, []).append({'time': time, 'value': round(value, 2)})
+
+    return {
+        'room': room,
+        'sensors': [{
+            'id': sensor.id,
+            'type': sensor.type,
+            'active': sensor.active,
+            'limitation': limitation,
+            'last': last_indications.get(sensor.id),
+            'open_event': open_events.get(sensor.id),
+            'sparkline': sparklines.get(sensor.id, [])
+        } for sensor, limitation in sensors]
+    }
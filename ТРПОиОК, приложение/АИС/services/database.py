@@ -1,18 +1,93 @@
+import time
 import settings
+import threading
 import sqlalchemy
-from typing import Optional
+from typing import Optional, Union
 from models.models_dao import Base
-from sqlalchemy.engine import Engine
+from sqlalchemy import exc
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.engine import Engine, Connection, URL, make_url
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine, async_sessionmaker
 
 
 
-def get_engine(db_url: str = None, db_sync: bool = False) -> Optional[Engine]:
+# Асинхронные драйверы для диалектов: mysql+pymysql -> mysql+aiomysql, sqlite -> sqlite+aiosqlite #
+
+ASYNC_DRIVERS = {'mysql': 'aiomysql', 'sqlite': 'aiosqlite', 'postgresql': 'asyncpg'}
+
+
+
+class PoolMetrics:
+    # Учет выдач соединений, времени их получения (ожидание свободного, открытие, pre-ping) и отказов по pool_timeout
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+
+    def connect(self):
+        started = time.perf_counter()
+        try:
+            return super().connect()
+        except exc.TimeoutError:
+            with self.lock:
+                self.timeouts += 1
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            with self.lock:
+                self.checkouts += 1
+                self.wait_total += elapsed
+                self.wait_max = max(self.wait_max, elapsed)
+
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                'size': self.size(),
+                'max_overflow': self._max_overflow,
+                'checked_in': self.checkedin(),
+                'checked_out': self.checkedout(),
+                'overflow': max(self.overflow(), 0),
+                'checkouts': self.checkouts,
+                'timeouts': self.timeouts,
+                'wait_avg_ms': round(self.wait_total / self.checkouts * 1000, 3) if self.checkouts else 0.0,
+                'wait_max_ms': round(self.wait_max * 1000, 3)
+            }
+
+
+class MeteredQueuePool(PoolMetrics, QueuePool):
+    pass
+
+
+class MeteredAsyncQueuePool(PoolMetrics, AsyncAdaptedQueuePool):
+    pass
+
+
+
+def get_engine_options(db_url: Union[str, URL], poolclass: type, pool_size: int, max_overflow: int) -> dict:
+    options = {'echo': settings.DATABASE_ECHO, 'pool_pre_ping': settings.DATABASE_POOL_PRE_PING,
+               'pool_recycle': settings.DATABASE_POOL_RECYCLE}
+    # SQLite в памяти живет в одном соединении, для него остается пул по умолчанию
+    url = make_url(db_url)
+    if url.get_backend_name() != 'sqlite' or url.database not in (None, '', ':memory:'):
+        options.update(poolclass=poolclass, pool_size=pool_size, max_overflow=max_overflow,
+                       pool_timeout=settings.DATABASE_POOL_TIMEOUT)
+    return options
+
+
+def get_engine(db_url: str = None, db_sync: bool = False, pool_size: int = settings.DATABASE_BACKGROUND_POOL_SIZE,
+               max_overflow: int = settings.DATABASE_BACKGROUND_MAX_OVERFLOW) -> Optional[Engine]:
+    # Синхронный движок обслуживает фоновые потоки, поэтому по умолчанию получает фоновую часть соединений
     try:
         if db_url is None:
             db_url = settings.DATABASE_URL
 
-        engine = sqlalchemy.create_engine(url=db_url, echo=True)
+        engine = sqlalchemy.create_engine(url=db_url, **get_engine_options(db_url, MeteredQueuePool, pool_size, max_overflow))
 
         if db_sync:
             Base.metadata.create_all(bind=engine)
@@ -24,5 +99,76 @@ def get_engine(db_url: str = None, db_sync: bool = False) -> Optional[Engine]:
         return None
 
 
+def get_async_url(db_url: str) -> URL:
+    url = make_url(db_url)
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"Для СУБД {backend} не задан асинхронный драйвер")
+    return url.set(drivername=f"{backend}+{ASYNC_DRIVERS[backend]}")
+
+
+def get_async_engine(db_url: str = None) -> Optional[AsyncEngine]:
+    try:
+        db_url = get_async_url(db_url or settings.DATABASE_URL)
+        return create_async_engine(db_url, **get_engine_options(db_url, MeteredAsyncQueuePool, settings.DATABASE_POOL_SIZE,
+                                                                 settings.DATABASE_MAX_OVERFLOW))
+
+    except Exception as error:
+        print(f"Ошибка при создании асинхронного движка БД: {error}")
+        return None
+
+
 def get_session_fabric(engine: Engine):
     return sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+
+def get_async_session_fabric(engine: AsyncEngine):
+    # Объекты не истекают после commit: ответ сериализуется вне сессии, где ленивая загрузка недоступна
+    return async_sessionmaker(bind=engine, autoflush=False, expire_on_commit=False)
+
+
+def get_pool_stats(engine: Union[Engine, AsyncEngine]) -> dict:
+    pool = engine.pool
+    if isinstance(pool, PoolMetrics):
+        return pool.stats()
+    return {'class': type(pool).__name__}
+
+
+def acquire_lock(connection: Connection, name: str) -> bool:
+    if connection.dialect.name == 'mysql':
+        return connection.execute(sqlalchemy.text("SELECT GET_LOCK(:name, 0)"), {'name': name}).scalar() == 1
+    if connection.dialect.name == 'postgresql':
+        return connection.execute(sqlalchemy.text("SELECT pg_try_advisory_lock(hashtext(:name))"), {'name': name}).scalar()
+    return True
+
+
+def release_lock(connection: Connection, name: str):
+    if connection.dialect.name == 'mysql':
+        connection.execute(sqlalchemy.text("SELECT RELEASE_LOCK(:name)"), {'name': name})
+    elif connection.dialect.name == 'postgresql':
+        connection.execute(sqlalchemy.text("SELECT pg_advisory_unlock(hashtext(:name))"), {'name': name})
+
+
+
+# Движки и фабрики сессий процесса: асинхронные - для запросов, синхронные - для фоновых потоков
+# (сборщики очереди и шарды показаний, очистка, выгрузка).
+# Функции CRUD остаются синхронными и общими для обоих путей: маршруты вызывают их через AsyncSession.run_sync, где
+# каждый запрос функции ожидает асинхронный драйвер и отдает цикл событий другим запросам. Цикл занимает только
+# работа Python между запросами #
+
+engine = get_engine()
+SessionLocal = get_session_fabric(engine)
+
+async_engine = get_async_engine()
+AsyncSessionLocal = get_async_session_fabric(async_engine)
+
+async def get_db():
+    db = AsyncSessionLocal()
+    try:
+        yield db
+        await db.commit()
+    except:
+        await db.rollback()
+        raise
+    finally:
+        await db.close()
@@ -0,0 +1,62 @@
+import io
+import csv
+import json
+import zlib
+from typing import Iterator, Literal, Callable
+from services.CRUD import iterate_indications
+
+
+
+ExportFormats = Literal['ndjson', 'csv']
+EXPORT_COLUMNS = ['sensor_id', 'time', 'value', 'status']
+MEDIA_TYPES = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+
+
+
+def encode_ndjson(rows: list) -> str:
+    return ''.join(json.dumps({'sensor_id': sensor_id, 'time': time.isoformat(), 'value': value, 'status': status},
+                              ensure_ascii=False) + '\n' for sensor_id, time, value, status in rows)
+
+
+def encode_csv(rows: list, header: bool = False) -> str:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    if header:
+        writer.writerow(EXPORT_COLUMNS)
+    writer.writerows((sensor_id, time.isoformat(), value, status) for sensor_id, time, value, status in rows)
+    return buffer.getvalue()
+
+
+def encode_chunks(rows: Iterator[tuple], export_format: ExportFormats, chunk_size: int = 1000) -> Iterator[bytes]:
+    if export_format == 'csv':
+        yield encode_csv([], header=True).encode()
+
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            yield (encode_csv(chunk) if export_format == 'csv' else encode_ndjson(chunk)).encode()
+            chunk = []
+
+    if chunk:
+        yield (encode_csv(chunk) if export_format == 'csv' else encode_ndjson(chunk)).encode()
+
+
+def gzip_chunks(chunks: Iterator[bytes]) -> Iterator[bytes]:
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export_indications(session_fabric: Callable, filters: dict, export_format: ExportFormats = 'ndjson',
+                       compress: bool = False, chunk_size: int = 1000) -> Iterator[bytes]:
+    # Экспорт открывает свою сессию: ответ отдается уже после выхода из зависимостей маршрута
+    db = session_fabric()
+    try:
+        chunks = encode_chunks(iterate_indications(db, chunk_size=chunk_size, **filters), export_format, chunk_size)
+        yield from (gzip_chunks(chunks) if compress else chunks)
+    finally:
+        db.close()
@@ -0,0 +1,80 @@
+import threading
+from collections import deque
+from typing import List, Optional
+from datetime import datetime, timedelta
+
+
+
+class ForecastWindows:
+    def __init__(self, hour: int = 3):
+        self.hour = hour
+        self.period = timedelta(hours=hour)
+        self.windows = {}
+        # Счетчик записанных показаний датчика (sensor_state.sequence), которому соответствует окно
+        self.sequences = {}
+        self.lock = threading.Lock()
+
+
+    def load(self, sensor_id: int, points: List[tuple], sequence: int):
+        with self.lock:
+            self.windows[sensor_id] = deque(points)
+            self.sequences[sensor_id] = sequence
+
+
+    def append(self, sensor_id: int, time: datetime, value: float):
+        with self.lock:
+            window = self.windows.get(sensor_id)
+            if window is None:
+                return
+
+            if window and time < window[-1][0]:
+                del self.windows[sensor_id]
+                return
+
+            window.append((time, value))
+            self.sequences[sensor_id] += 1
+
+
+    def predict(self, sensor_id: int, value: float, sequence: int) -> Optional[float]:
+        # Окно, отстающее от счетчика в БД, пропустило показания другого процесса и должно быть загружено заново
+        required_time = datetime.now() - self.period
+
+        with self.lock:
+            window = self.windows.get(sensor_id)
+            if window is None or self.sequences[sensor_id] != sequence:
+                return None
+
+            while window and window[0][0] < required_time:
+                window.popleft()
+
+            if not window:
+                return value
+
+            # Средний шаг между соседними показаниями равен (последнее - первое) / число шагов
+            avg_change = (value - window[0][1]) / len(window)
+
+        return round(value + avg_change * 60, 2)
+
+
+    def invalidate(self, sensor_id: int):
+        with self.lock:
+            self.windows.pop(sensor_id, None)
+            self.sequences.pop(sensor_id, None)
+
+
+    def clear(self):
+        with self.lock:
+            self.windows.clear()
+            self.sequences.clear()
+
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                'sensors': len(self.windows),
+                'points': sum(len(window) for window in self.windows.values())
+            }
+
+
+
+forecast_windows = ForecastWindows(3)
@@ -0,0 +1,152 @@
+import json
+import struct
+import asyncio
+import traceback
+from datetime import datetime
+from typing import Callable, List
+
+
+
+class IngestionQueue:
+    def __init__(self, process: Callable[[List[dict]], object], queue_size: int = 10000, batch_size: int = 500,
+                 flush_interval: float = 0.5, flushers: int = 2):
+        self.process = process
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.flushers = flushers
+
+        self.queue = None
+        self.tasks = []
+        self.closing = False
+        self.accepted = 0
+        self.rejected = 0
+        self.flushed = 0
+        self.failed = 0
+
+
+    async def start(self):
+        self.closing = False
+        self.queue = asyncio.Queue(maxsize=self.queue_size)
+        self.tasks = [asyncio.create_task(self.flusher()) for _ in range(self.flushers)]
+
+
+    def put(self, reading: dict) -> bool:
+        if self.queue is None or self.closing:
+            self.rejected += 1
+            return False
+
+        try:
+            self.queue.put_nowait(reading)
+        except asyncio.QueueFull:
+            self.rejected += 1
+            return False
+
+        self.accepted += 1
+        return True
+
+
+    async def collect(self) -> tuple:
+        batch, closed = [], False
+
+        reading = await self.queue.get()
+        if reading is None:
+            return batch, True
+        batch.append(reading)
+
+        deadline = asyncio.get_running_loop().time() + self.flush_interval
+        while len(batch) < self.batch_size:
+            timeout = deadline - asyncio.get_running_loop().time()
+            if timeout <= 0:
+                break
+
+            try:
+                reading = await asyncio.wait_for(self.queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+
+            if reading is None:
+                closed = True
+                break
+            batch.append(reading)
+
+        return batch, closed
+
+
+    async def flusher(self):
+        closed = False
+        while not closed:
+            batch, closed = await self.collect()
+            if not batch:
+                continue
+
+            try:
+                await asyncio.to_thread(self.process, batch)
+                self.flushed += len(batch)
+            except Exception:
+                self.failed += len(batch)
+                print(f'Исключение при записи пакета показаний: {traceback.format_exc()}')
+
+
+    async def stop(self):
+        if self.queue is None or self.closing:
+            return
+
+        self.closing = True
+        for _ in self.tasks:
+            await self.queue.put(None)
+
+        await asyncio.gather(*self.tasks)
+        self.tasks = []
+        self.queue = None
+
+
+    def stats(self) -> dict:
+        return {
+            'queued': self.queue.qsize() if self.queue else 0,
+            'queue_size': self.queue_size,
+            'accepted': self.accepted,
+            'rejected': self.rejected,
+            'flushed': self.flushed,
+            'failed': self.failed
+        }
+
+
+
+# Кадры потокового приема: строки JSON или записи <sensor_id: uint32, value: float64, time: uint64 мс, 0 - текущее> #
+
+BINARY_READING = struct.Struct('<IdQ')
+
+def to_local_time(time: datetime) -> datetime:
+    # Показания хранятся в локальном времени без пояса, время с поясом приводится к нему
+    if time.tzinfo is not None:
+        return time.astimezone().replace(tzinfo=None)
+    return time
+
+
+def parse_text_frame(frame: str) -> tuple:
+    readings, errors = [], {}
+
+    for index, line in enumerate(line for line in frame.splitlines() if line.strip()):
+        try:
+            data = json.loads(line)
+            time = data.get('time')
+            readings.append({'sensor_id': int(data['sensor_id']), 'value': float(data['value']),
+                             'time': to_local_time(datetime.fromisoformat(time)) if time else datetime.now()})
+        except (ValueError, TypeError, KeyError, AttributeError) as e:
+            readings.append(None)
+            errors[index] = f"Некорректное показание: {e!r}"
+
+    return readings, errors
+
+
+def parse_binary_frame(frame: bytes) -> tuple:
+    if len(frame) % BINARY_READING.size:
+        raise ValueError(f"Длина кадра должна быть кратна {BINARY_READING.size} байтам")
+
+    readings = []
+    for sensor_id, value, time in BINARY_READING.iter_unpack(frame):
+        readings.append({'sensor_id': sensor_id, 'value': value,
+                         'time': datetime.fromtimestamp(time / 1000) if time else datetime.now()})
+
+    return readings, {}
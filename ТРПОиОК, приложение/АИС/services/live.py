@@ -0,0 +1,123 @@
+import json
+import asyncio
+import settings
+import threading
+from datetime import datetime
+from typing import Literal, Callable, Awaitable, AsyncIterator
+
+
+
+LiveScopes = Literal['sensor', 'room', 'company']
+
+
+
+class Subscription:
+    def __init__(self, scope: LiveScopes, scope_id: int, queue_size: int):
+        self.key = f'{scope}_id'
+        self.scope_id = scope_id
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.dropped = 0
+
+
+    def matches(self, message: dict) -> bool:
+        return message[self.key] == self.scope_id
+
+
+    def deliver(self, message: dict):
+        # Вызывается в цикле событий подписчика; медленный клиент теряет сообщения, а не тормозит запись
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            self.dropped += 1
+
+
+
+class LiveHub:
+    def __init__(self, queue_size: int = 1000):
+        self.queue_size = queue_size
+        self.subscriptions = set()
+        self.statuses = {}
+        self.lock = threading.Lock()
+        self.published = 0
+
+
+    def subscribe(self, scope: LiveScopes, scope_id: int) -> Subscription:
+        subscription = Subscription(scope, scope_id, self.queue_size)
+        with self.lock:
+            self.subscriptions.add(subscription)
+        return subscription
+
+
+    def unsubscribe(self, subscription: Subscription):
+        with self.lock:
+            self.subscriptions.discard(subscription)
+
+
+    def publish(self, message: dict):
+        with self.lock:
+            subscriptions = [subscription for subscription in self.subscriptions if subscription.matches(message)]
+            self.published += 1
+
+        for subscription in subscriptions:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.deliver, message)
+            except RuntimeError:
+                self.unsubscribe(subscription)
+
+
+    def publish_indication(self, context: dict, time: datetime, value: float, status: str):
+        if not self.subscriptions:
+            self.statuses.pop(context['id'], None)
+            return
+
+        scope = {'sensor_id': context['id'], 'room_id': context['room_id'], 'company_id': context['company_id']}
+        self.publish({'type': 'indication', **scope, 'time': time, 'value': value, 'status': status})
+
+        if self.statuses.get(context['id']) != status:
+            self.statuses[context['id']] = status
+            self.publish({'type': 'status', **scope, 'time': time, 'status': status})
+
+
+    def publish_event(self, context: dict, time: datetime, description: str):
+        if not self.subscriptions:
+            return
+
+        self.publish({'type': 'event', 'sensor_id': context['id'], 'room_id': context['room_id'],
+                      'company_id': context['company_id'], 'time': time, 'description': description})
+
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                'subscribers': len(self.subscriptions),
+                'published': self.published,
+                'dropped': sum(subscription.dropped for subscription in self.subscriptions)
+            }
+
+
+
+def format_message(message: dict) -> str:
+    data = {key: value for key, value in message.items() if key != 'type'}
+    return f"event: {message['type']}\ndata: {json.dumps(data, default=datetime.isoformat, ensure_ascii=False)}\n\n"
+
+
+
+async def stream_messages(hub: LiveHub, subscription: Subscription, is_disconnected: Callable[[], Awaitable[bool]],
+                          heartbeat: float = 15) -> AsyncIterator[str]:
+    try:
+        yield "retry: 3000\n\n"
+        while not await is_disconnected():
+            try:
+                message = await asyncio.wait_for(subscription.queue.get(), heartbeat)
+            except asyncio.TimeoutError:
+                yield ": ping\n\n"
+                continue
+
+            yield format_message(message)
+    finally:
+        hub.unsubscribe(subscription)
+
+
+
+live_hub = LiveHub(settings.LIVE_QUEUE_SIZE)
@@ -0,0 +1,269 @@
+import argparse
+import settings
+import sqlalchemy
+from typing import List
+from datetime import datetime
+from sqlalchemy.engine import Engine, Connection
+from sqlalchemy.orm import Session
+from services.CRUD import (get_sensor_ids, iterate_indications, update_rollups, get_last_per_sensor, upsert_sensor_states,
+                           set_sensor_states_open_event)
+from models.models_dao import Base, SchemaVersion, Indication, Event, ChangeLog, EntityVersion
+
+
+
+# Операции над схемой #
+
+def has_index(connection: Connection, table: str, name: str) -> bool:
+    return any(index['name'] == name for index in sqlalchemy.inspect(connection).get_indexes(table))
+
+
+def create_index(connection: Connection, table: str, name: str, columns: List[str]):
+    if has_index(connection, table, name):
+        return
+
+    if connection.dialect.name == 'mysql':
+        # Построение индекса без блокировки таблицы на запись
+        columns = ', '.join(f'`{column}`' for column in columns)
+        connection.exec_driver_sql(f"ALTER TABLE `{table}` ADD INDEX `{name}` ({columns}), ALGORITHM=INPLACE, LOCK=NONE")
+    else:
+        columns = ', '.join(f'"{column}"' for column in columns)
+        connection.exec_driver_sql(f'CREATE INDEX "{name}" ON "{table}" ({columns})')
+
+
+def drop_index(connection: Connection, table: str, name: str):
+    if not has_index(connection, table, name):
+        return
+
+    if connection.dialect.name == 'mysql':
+        connection.exec_driver_sql(f"ALTER TABLE `{table}` DROP INDEX `{name}`, ALGORITHM=INPLACE, LOCK=NONE")
+    else:
+        connection.exec_driver_sql(f'DROP INDEX "{name}"')
+
+
+def has_column(connection: Connection, table: str, name: str) -> bool:
+    return any(column['name'] == name for column in sqlalchemy.inspect(connection).get_columns(table))
+
+
+def add_column(connection: Connection, table: str, name: str):
+    if has_column(connection, table, name):
+        return
+
+    # Определение столбца (тип, NOT NULL, DEFAULT) берется из модели
+    column = sqlalchemy.schema.CreateColumn(Base.metadata.tables[table].columns[name]).compile(dialect=connection.dialect)
+    if connection.dialect.name == 'mysql':
+        connection.exec_driver_sql(f"ALTER TABLE `{table}` ADD COLUMN {column}, ALGORITHM=INPLACE, LOCK=NONE")
+    else:
+        connection.exec_driver_sql(f'ALTER TABLE "{table}" ADD COLUMN {column}')
+
+
+def drop_column(connection: Connection, table: str, name: str):
+    if not has_column(connection, table, name):
+        return
+
+    if connection.dialect.name == 'mysql':
+        connection.exec_driver_sql(f"ALTER TABLE `{table}` DROP COLUMN `{name}`, ALGORITHM=INPLACE, LOCK=NONE")
+    else:
+        connection.exec_driver_sql(f'ALTER TABLE "{table}" DROP COLUMN "{name}"')
+
+
+def create_table(connection: Connection, name: str):
+    Base.metadata.tables[name].create(connection, checkfirst=True)
+
+
+def drop_table(connection: Connection, name: str):
+    Base.metadata.tables[name].drop(connection, checkfirst=True)
+
+
+
+# Миграции #
+
+def upgrade_1(connection: Connection):
+    create_index(connection, 'indication', 'ix_indication_time', ['time'])
+    create_index(connection, 'sensor',     'ix_sensor_room_id',  ['room_id'])
+
+
+def downgrade_1(connection: Connection):
+    drop_index(connection, 'sensor',     'ix_sensor_room_id')
+    drop_index(connection, 'indication', 'ix_indication_time')
+
+
+def upgrade_2(connection: Connection):
+    create_table(connection, 'indication_minute')
+    create_table(connection, 'indication_hour')
+
+    # Агрегаты заполняются по еще не удаленным сырым показаниям
+    db = Session(bind=connection, autoflush=False)
+    for sensor_id in get_sensor_ids(db):
+        rows = list(iterate_indications(db, sensor_id=sensor_id))
+        if rows:
+            update_rollups(db, [{'sensor_id': sensor_id, 'time': time, 'value': value, 'status': status}
+                                for sensor_id, time, value, status in rows])
+
+
+def downgrade_2(connection: Connection):
+    drop_table(connection, 'indication_hour')
+    drop_table(connection, 'indication_minute')
+
+
+def upgrade_3(connection: Connection):
+    create_table(connection, 'sensor_state')
+
+    # Состояние заполняется по последнему показанию и последнему событию каждого датчика
+    db = Session(bind=connection, autoflush=False)
+    indications = get_last_per_sensor(db, Indication)
+    if indications:
+        upsert_sensor_states(db, [{'sensor_id': indication.sensor_id, 'time': indication.time, 'value': indication.value,
+                                   'status': indication.status, 'prediction': None} for indication in indications])
+
+    events = get_last_per_sensor(db, Event)
+    if events:
+        set_sensor_states_open_event(db, {event.sensor_id: not event.eliminated for event in events})
+
+
+def downgrade_3(connection: Connection):
+    drop_table(connection, 'sensor_state')
+
+
+def upgrade_4(connection: Connection):
+    # Отсутствующая строка означает версию 0, поэтому заполнять таблицу не нужно
+    create_table(connection, 'entity_version')
+
+
+def downgrade_4(connection: Connection):
+    drop_table(connection, 'entity_version')
+
+
+def upgrade_5(connection: Connection):
+    # Журнал ведется с момента миграции, клиенты начинают синхронизацию с полной загрузки
+    create_table(connection, 'change_log')
+
+
+def downgrade_5(connection: Connection):
+    drop_table(connection, 'change_log')
+
+
+def upgrade_6(connection: Connection):
+    add_column(connection, 'user', 'credential_version')
+
+
+def downgrade_6(connection: Connection):
+    drop_column(connection, 'user', 'credential_version')
+
+
+def upgrade_7(connection: Connection):
+    add_column(connection, 'sensor_state', 'sequence')
+
+
+def downgrade_7(connection: Connection):
+    drop_column(connection, 'sensor_state', 'sequence')
+
+
+def upgrade_8(connection: Connection):
+    create_table(connection, 'job_run')
+
+
+def downgrade_8(connection: Connection):
+    drop_table(connection, 'job_run')
+
+
+def upgrade_9(connection: Connection):
+    # Счетчик продолжает уже выданные автоинкрементом номера журнала
+    last = connection.execute(sqlalchemy.select(sqlalchemy.func.max(ChangeLog.id))).scalar()
+    counter = connection.execute(sqlalchemy.select(EntityVersion.version).where(EntityVersion.entity == 'change_log')).scalar()
+    if last and counter is None:
+        connection.execute(sqlalchemy.insert(EntityVersion).values(entity='change_log', scope_id=0, version=last))
+
+
+def downgrade_9(connection: Connection):
+    connection.execute(sqlalchemy.delete(EntityVersion).where(EntityVersion.entity == 'change_log'))
+
+
+MIGRATIONS = [
+    (1, "Индексы для очистки показаний и выборки датчиков помещения", upgrade_1, downgrade_1),
+    (2, "Минутные и часовые агрегаты показаний", upgrade_2, downgrade_2),
+    (3, "Последнее известное состояние датчиков", upgrade_3, downgrade_3),
+    (4, "Версии списков для условных запросов", upgrade_4, downgrade_4),
+    (5, "Журнал изменений для синхронизации клиентов", upgrade_5, downgrade_5),
+    (6, "Версия учетных данных пользователя для отзыва токенов", upgrade_6, downgrade_6),
+    (7, "Счетчик записанных показаний датчика для окон прогноза", upgrade_7, downgrade_7),
+    (8, "Последнее выполнение фоновых задач для нескольких процессов", upgrade_8, downgrade_8),
+    (9, "Счетчик версий журнала изменений", upgrade_9, downgrade_9),
+]
+
+
+
+def get_version(connection: Connection) -> int:
+    SchemaVersion.__table__.create(connection, checkfirst=True)
+    result = connection.execute(sqlalchemy.select(sqlalchemy.func.max(SchemaVersion.version))).scalar()
+    return result or 0
+
+
+def upgrade(engine: Engine, target: int = None) -> int:
+    target = MIGRATIONS[-1][0] if target is None else target
+
+    with engine.connect() as connection:
+        if connection.dialect.name == 'mysql':
+            connection.exec_driver_sql("SET SESSION lock_wait_timeout = 5")
+
+        version = get_version(connection)
+        fresh = not sqlalchemy.inspect(connection).has_table('company')
+        if fresh:
+            # Пустая БД создается сразу по моделям, изменения миграций новее target отменяются, остальные только отмечаются
+            Base.metadata.create_all(connection)
+            for number, _, _, downgrade_func in reversed(MIGRATIONS):
+                if number > target:
+                    downgrade_func(connection)
+
+        for number, description, upgrade_func, _ in MIGRATIONS:
+            if version < number <= target:
+                if not fresh:
+                    upgrade_func(connection)
+                connection.execute(sqlalchemy.insert(SchemaVersion).values(version=number, description=description,
+                                                                           applied=datetime.now()))
+                connection.commit()
+                print(f"Применена миграция {number}: {description}")
+                version = number
+
+    return version
+
+
+def downgrade(engine: Engine, target: int = 0) -> int:
+    with engine.connect() as connection:
+        if connection.dialect.name == 'mysql':
+            connection.exec_driver_sql("SET SESSION lock_wait_timeout = 5")
+
+        version = get_version(connection)
+        for number, description, _, downgrade_func in reversed(MIGRATIONS):
+            if target < number <= version:
+                downgrade_func(connection)
+                connection.execute(sqlalchemy.delete(SchemaVersion).where(SchemaVersion.version == number))
+                connection.commit()
+                print(f"Отменена миграция {number}: {description}")
+                version = number - 1
+
+    return version
+
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Миграции схемы БД")
+    parser.add_argument('command', choices=['upgrade', 'downgrade', 'status'])
+    parser.add_argument('target', type=int, nargs='?', default=None)
+    parser.add_argument('--url', default=settings.DATABASE_URL)
+    args = parser.parse_args()
+
+    engine = sqlalchemy.create_engine(url=args.url)
+
+    if args.command == 'upgrade':
+        upgrade(engine, args.target)
+    elif args.command == 'downgrade':
+        downgrade(engine, args.target or 0)
+
+    with engine.connect() as connection:
+        print(f"Текущая версия схемы: {get_version(connection)} (последняя: {MIGRATIONS[-1][0]})")
+        connection.commit()
+
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,12 @@
 from datetime import datetime
+from typing import List
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from services.analysis import AnalysisService
-from services.CRUD import create_indication, create_event, get_events_by_sensor_id
+from services.forecast import forecast_windows
+from services.live import live_hub
+from services.CRUD import (create_indications_and_events, get_open_event_by_sensor_id, get_sensor_sequences,
+                           lock_sensors, round_indication_time, get_existing_indication_keys)
 
 
 
@@ -14,42 +19,121 @@ class MonitoringService:
 
     def process_indication(self, sensor_id: int, value: float):
         try:
+            lock_sensors(self.db, [sensor_id])
             analysis_result = self.analysis.analyze(sensor_id, value)
 
-            create_indication(self.db, sensor_id, None, value, analysis_result['status'])
+            time = datetime.now()
+            indication = {'sensor_id': sensor_id, 'time': time, 'value': value, 'status': analysis_result['status']}
+            state = {**indication, 'prediction': analysis_result['prediction']}
 
-            self.cleanup()
+            # Открытое событие проверяется и новое записывается в транзакции показания, пока строка датчика заблокирована
+            events = []
+            if analysis_result['current_violation'] and get_open_event_by_sensor_id(self.db, sensor_id) is None:
+                events.append({'sensor_id': sensor_id, 'time': time, 'eliminated': True,
+                               'description': self.describe_event(value, analysis_result)})
 
-            if analysis_result['current_violation']:
-                self.create_event(sensor_id, value, analysis_result)
+            if create_indications_and_events(self.db, [indication], events, [state]):
+                self.analysis.observe(sensor_id, time, value)
+                context = self.analysis.context(sensor_id)
+                live_hub.publish_indication(context, time, value, analysis_result['status'])
+                for event in events:
+                    live_hub.publish_event(context, event['time'], event['description'])
 
         except Exception as e:
             print(f"Ошибка при создании показания: {e}")
             self.db.rollback()
 
 
-    def create_event(self, sensor_id: int, value: float, analysis: dict):
-        try:
-            event = get_events_by_sensor_id(self.db, sensor_id)
+    def process_batch(self, readings: List[dict]) -> List[dict]:
+        results, indications, events, states = [], [], [], {}
+        contexts, opened, times = {}, {}, set()
+        # Датчики пакета блокируются до записи, счетчики читаются одним запросом и дальше ведутся по показаниям пакета
+        lock_sensors(self.db, [reading['sensor_id'] for reading in readings])
+        sequences = get_sensor_sequences(self.db, [reading['sensor_id'] for reading in readings])
 
-            if event and not event[-1].eliminated:
-                return None
+        # Время приводится к точности столбца, чтобы повтор ключа (датчик, время) отклонял только свое показание
+        stamps = [round_indication_time(self.db, reading.get('time') or datetime.now()) for reading in readings]
+        existing = get_existing_indication_keys(self.db, [(reading['sensor_id'], time) for reading, time in zip(readings, stamps)])
 
-            if value < analysis['limitation_min']:
-                comparison = "<"
-            else:
-                comparison = ">"
+        for reading, time in zip(readings, stamps):
+            sensor_id, value = reading['sensor_id'], reading['value']
 
-            description = (
-                f"Показатель {analysis['sensor_type']} = {value} {comparison} нормы "
-                f"(норма: {analysis['limitation_min']}-{analysis['limitation_max']})"
-            )
+            result = {'sensor_id': sensor_id, 'time': time, 'value': value, 'accepted': False}
+            results.append(result)
 
-            create_event(self.db, sensor_id, True, description)
+            try:
+                if (sensor_id, time) in existing:
+                    raise ValueError(f"Показание датчика {sensor_id} за {time} уже записано")
+                if (sensor_id, time) in times:
+                    raise ValueError(f"Показание датчика {sensor_id} за {time} повторяется в пакете")
 
-        except Exception as e:
-            print(f"Ошибка при создании события: {e}")
-            return None
+                if sensor_id not in contexts:
+                    try:
+                        contexts[sensor_id] = self.analysis.context(sensor_id)
+                    except ValueError as e:
+                        contexts[sensor_id] = e
+
+                if isinstance(contexts[sensor_id], ValueError):
+                    raise contexts[sensor_id]
+
+                if sensor_id not in opened:
+                    opened[sensor_id] = get_open_event_by_sensor_id(self.db, sensor_id) is not None
+
+                prediction = self.analysis.forecast(sensor_id, value, sequences.get(sensor_id, 0))
+                analysis_result = self.analysis.evaluate(contexts[sensor_id], value, prediction)
+
+                # Время, несравнимое с окном прогноза (например, с часовым поясом), отклоняет только это показание
+                self.analysis.observe(sensor_id, time, value)
+
+            except (ValueError, TypeError) as e:
+                result['error'] = str(e)
+                continue
+
+            times.add((sensor_id, time))
+            sequences[sensor_id] = sequences.get(sensor_id, 0) + 1
+            indications.append({'sensor_id': sensor_id, 'time': time, 'value': value, 'status': analysis_result['status']})
+
+            if sensor_id not in states or states[sensor_id]['time'] <= time:
+                states[sensor_id] = {**indications[-1], 'prediction': prediction}
+
+            if analysis_result['current_violation'] and not opened[sensor_id]:
+                events.append({'sensor_id': sensor_id, 'time': time, 'eliminated': True,
+                               'description': self.describe_event(value, analysis_result)})
+
+            result['status'] = analysis_result['status']
+            result['accepted'] = True
+
+        if indications and not create_indications_and_events(self.db, indications, events, list(states.values())):
+            for sensor_id in contexts:
+                forecast_windows.invalidate(sensor_id)
+
+            for result in results:
+                if result['accepted']:
+                    result['accepted'] = False
+                    result['status'] = None
+                    result['error'] = "Не удалось сохранить пакет показаний"
+
+            return results
+
+        for indication in indications:
+            live_hub.publish_indication(contexts[indication['sensor_id']], indication['time'], indication['value'], indication['status'])
+        for event in events:
+            live_hub.publish_event(contexts[event['sensor_id']], event['time'], event['description'])
+
+        return results
+
+
+    @staticmethod
+    def describe_event(value: float, analysis: dict) -> str:
+        if value < analysis['limitation_min']:
+            comparison = "<"
+        else:
+            comparison = ">"
+
+        return (
+            f"Показатель {analysis['sensor_type']} = {value} {comparison} нормы "
+            f"(норма: {analysis['limitation_min']}-{analysis['limitation_max']})"
+        )
 
 
     def cleanup(self):
@@ -62,3 +146,14 @@ class MonitoringService:
 
         except Exception as e:
             print(f"Ошибка при очистке данных: {e}")
+
+
+
+# Обработка в асинхронной сессии: запросы анализа и записи идут через асинхронный драйвер и не блокируют цикл событий #
+
+async def process_indication(db: AsyncSession, sensor_id: int, value: float):
+    await db.run_sync(lambda session: MonitoringService(session).process_indication(sensor_id, value))
+
+
+async def process_batch(db: AsyncSession, readings: List[dict]) -> List[dict]:
+    return await db.run_sync(lambda session: MonitoringService(session).process_batch(readings))
@@ -0,0 +1,53 @@
+from services import cache
+from services.CRUD import *
+from sqlalchemy.ext.asyncio import AsyncSession
+
+
+
+# Компании-владельцы помещений и датчиков для проверки прав. Результаты запоминаются на время запроса, а между
+# запросами берутся из общих кэшей: помещение - из room_cache, датчик - из метаданных sensor_cache #
+
+class Ownership:
+    def __init__(self, db: AsyncSession):
+        self.db = db
+        self.rooms = {}
+        self.sensors = {}
+
+
+    async def load_rooms(self, *room_ids: int):
+        # Недостающие в кэше помещения читаются одним запросом
+        missing = set()
+        for room_id in set(room_ids) - self.rooms.keys():
+            company_id = cache.room_cache.get(room_id)
+            if company_id is cache.MISSING:
+                missing.add(room_id)
+            else:
+                self.rooms[room_id] = company_id
+
+        if missing:
+            company_ids = await self.db.run_sync(get_company_ids_by_room_ids, missing)
+            for room_id in missing:
+                company_id = company_ids.get(room_id)
+                if company_id is not None:
+                    cache.room_cache.put(room_id, company_id)
+                self.rooms[room_id] = company_id
+
+
+    async def room_company_id(self, room_id: int) -> Optional[int]:
+        await self.load_rooms(room_id)
+        return self.rooms[room_id]
+
+
+    async def sensor_company_id(self, sensor_id: int) -> Optional[int]:
+        # Датчик, помещение и компания читаются одним запросом вместе с метаданными датчика
+        if sensor_id not in self.sensors:
+            metadata = cache.sensor_cache.get(sensor_id)
+            if metadata is cache.MISSING:
+                metadata = await self.db.run_sync(get_sensor_metadata, sensor_id)
+                cache.sensor_cache.put(sensor_id, metadata)
+
+            self.sensors[sensor_id] = metadata['company_id'] if metadata else None
+            if metadata:
+                self.rooms.setdefault(metadata['room_id'], metadata['company_id'])
+
+        return self.sensors[sensor_id]
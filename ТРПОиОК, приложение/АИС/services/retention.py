@@ -0,0 +1,163 @@
+import os
+import socket
+import threading
+import traceback
+from typing import Optional
+from sqlalchemy.orm import Session
+from sqlalchemy.engine import Engine
+from datetime import datetime, timedelta
+from services.database import acquire_lock, release_lock
+from services.CRUD import (get_job_run, record_job_run, get_sensor_ids, get_indication_times_by_sensor_id_and_less_time,
+                           delete_indications_by_sensor_id_and_time_range, delete_rollups_by_sensor_id_and_less_time,
+                           delete_changes_by_less_time)
+
+
+
+# Очистку запускает каждый процесс приложения: блокировка в БД исключает одновременные проходы, а запись о последнем
+# завершенном проходе - повторную очистку другими процессами в том же интервале. Счетчики stats относятся к процессу #
+
+class RetentionWorker:
+    lock_name = 'ais_retention'
+
+    def __init__(self, engine: Engine, hour: int = 24, chunk_size: int = 1000, pause: float = 0.1, interval: int = 3600,
+                 rollups: list = None, changes: timedelta = None):
+        self.engine = engine
+        self.hour = hour
+        self.rollups = rollups or []
+        self.changes = changes
+        self.chunk_size = chunk_size
+        self.pause = pause
+        self.interval = interval
+
+        self.process = f'{socket.gethostname()}:{os.getpid()}'
+        self.thread = None
+        self.stopping = threading.Event()
+
+        self.runs = 0
+        self.skipped = 0
+        self.recent = 0
+        self.deleted = 0
+        self.chunks = 0
+        self.running = False
+        self.last_deleted = 0
+        self.last_started = None
+        self.last_finished = None
+        self.last_error = None
+
+
+    def start(self):
+        self.stopping.clear()
+        self.thread = threading.Thread(target=self.loop, name='retention', daemon=True)
+        self.thread.start()
+
+
+    def stop(self):
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+
+    def loop(self):
+        while not self.stopping.is_set():
+            try:
+                self.run_once()
+            except Exception:
+                self.last_error = traceback.format_exc()
+                print(f'Исключение при очистке показаний: {self.last_error}')
+
+            self.stopping.wait(self.interval)
+
+
+    def run_once(self) -> int:
+        with self.engine.connect() as connection:
+            if not acquire_lock(connection, self.lock_name):
+                self.skipped += 1
+                return 0
+            connection.commit()
+
+            try:
+                db = Session(bind=connection, autoflush=False)
+                try:
+                    last_run = get_job_run(db, self.lock_name)
+                    if last_run is not None and datetime.now() - last_run.finished < timedelta(seconds=self.interval):
+                        self.recent += 1
+                        return 0
+
+                    return self.purge(db)
+                finally:
+                    db.close()
+            finally:
+                release_lock(connection, self.lock_name)
+                connection.commit()
+
+
+    def purge(self, db: Session) -> int:
+        self.running = True
+        self.last_started = datetime.now()
+        self.last_deleted = 0
+        required_time = self.last_started - timedelta(hours=self.hour)
+
+        try:
+            for sensor_id in get_sensor_ids(db):
+                while not self.stopping.is_set():
+                    times = get_indication_times_by_sensor_id_and_less_time(db, sensor_id, required_time, self.chunk_size)
+                    if not times:
+                        break
+
+                    if not delete_indications_by_sensor_id_and_time_range(db, sensor_id, times[0], times[-1]):
+                        break
+
+                    self.chunks += 1
+                    self.last_deleted += len(times)
+
+                    if len(times) < self.chunk_size:
+                        break
+                    self.stopping.wait(self.pause)
+
+            # Агрегаты каждого уровня удаляются по своему сроку хранения
+            for model, _, retention in self.rollups:
+                for sensor_id in get_sensor_ids(db):
+                    if self.stopping.is_set():
+                        break
+                    delete_rollups_by_sensor_id_and_less_time(db, model, sensor_id, self.last_started - retention)
+
+            if self.changes is not None:
+                delete_changes_by_less_time(db, self.last_started - self.changes)
+
+            self.runs += 1
+            self.deleted += self.last_deleted
+            self.last_finished = datetime.now()
+            # Прерванный остановкой проход не считается завершенным
+            if not self.stopping.is_set():
+                record_job_run(db, self.lock_name, self.process, self.last_started, self.last_finished, self.last_deleted)
+            print(f"Удалено старых показаний: {self.last_deleted} (старше {self.hour} часов)")
+            return self.last_deleted
+
+        finally:
+            self.running = False
+
+
+    def last_run(self, db: Session) -> Optional[dict]:
+        # Последний завершенный проход любого процесса
+        result = get_job_run(db, self.lock_name)
+        if result is None:
+            return None
+
+        return {'process': result.process, 'started': result.started, 'finished': result.finished, 'deleted': result.result}
+
+
+    def stats(self) -> dict:
+        return {
+            'process': self.process,
+            'running': self.running,
+            'runs': self.runs,
+            'skipped': self.skipped,
+            'recent': self.recent,
+            'chunks': self.chunks,
+            'deleted': self.deleted,
+            'last_deleted': self.last_deleted,
+            'last_started': self.last_started,
+            'last_finished': self.last_finished,
+            'last_error': self.last_error
+        }
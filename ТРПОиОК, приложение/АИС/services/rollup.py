@@ -0,0 +1,28 @@
+import settings
+from datetime import datetime, timedelta
+from models.models_dao import Indication, IndicationMinute, IndicationHour
+
+
+
+# Уровни хранения показаний от грубого к точному: модель, шаг в секундах, срок хранения #
+
+ROLLUP_TIERS = [
+    (IndicationHour,   3600, timedelta(days=settings.ROLLUP_HOUR_DAYS)),
+    (IndicationMinute, 60,   timedelta(days=settings.ROLLUP_MINUTE_DAYS)),
+]
+
+TIERS = ROLLUP_TIERS + [(Indication, 1, timedelta(hours=settings.RETENTION_HOUR))]
+
+
+
+def select_tier(seconds: int, time_from: datetime, now: datetime = None):
+    now = now or datetime.now()
+    tiers = [(model, retention) for model, step, retention in TIERS if seconds % step == 0]
+
+    # Самый грубый уровень, шаг которого кратен интервалу и который еще хранит начало периода
+    for model, retention in tiers:
+        if time_from >= now - retention:
+            return model
+
+    # Иначе уровень с самым долгим хранением: начало периода уже частично удалено
+    return max(tiers, key=lambda tier: tier[1])[0]
@@ -0,0 +1,39 @@
+import json
+from datetime import datetime
+from typing import List, Sequence
+from pydantic import BaseModel
+from fastapi.responses import Response
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+
+def dumps(content) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(content, default=datetime.isoformat, ensure_ascii=False, separators=(',', ':')).encode()
+
+
+def dto_columns(dto: type[BaseModel]) -> tuple:
+    return tuple(dto.model_fields)
+
+
+def rows_to_dicts(columns: Sequence[str], rows: List[tuple]) -> List[dict]:
+    return [dict(zip(columns, row)) for row in rows]
+
+
+
+class FastJSONResponse(Response):
+    # Строки из БД уже соответствуют DTO, поэтому они кодируются напрямую без валидации pydantic
+    media_type = 'application/json'
+
+    def render(self, content) -> bytes:
+        return dumps(content)
+
+
+
+def rows_response(columns: Sequence[str], rows: List[tuple]) -> FastJSONResponse:
+    return FastJSONResponse(rows_to_dicts(columns, rows))
@@ -0,0 +1,78 @@
+import asyncio
+import threading
+from typing import Callable, List
+from concurrent.futures import ThreadPoolExecutor
+
+
+
+# Необязательное распределение показаний по потокам процесса. Порядок обработки показаний датчика между потоками и
+# процессами обеспечивает блокировка строки датчика в БД (lock_sensors), шарды лишь снижают ожидание этой блокировки #
+
+class ShardedExecutor:
+    def __init__(self, process: Callable[[List[dict]], List[dict]], shards: int = 4):
+        self.process = process
+        self.shards = shards
+        self.executors = [ThreadPoolExecutor(max_workers=1, thread_name_prefix=f'shard-{i}') for i in range(shards)]
+        self.lock = threading.Lock()
+        self.submitted = [0] * shards
+        self.completed = [0] * shards
+
+
+    def shard(self, sensor_id: int) -> int:
+        return sensor_id % self.shards
+
+
+    def submit(self, readings: List[dict]) -> list:
+        groups = {}
+        for index, reading in enumerate(readings):
+            groups.setdefault(self.shard(reading['sensor_id']), []).append(index)
+
+        # Каждый шард обрабатывает показания своих датчиков строго в порядке поступления
+        futures = []
+        for shard, indexes in groups.items():
+            with self.lock:
+                self.submitted[shard] += len(indexes)
+
+            future = self.executors[shard].submit(self.process, [readings[index] for index in indexes])
+            future.add_done_callback(lambda _, shard=shard, count=len(indexes): self.complete(shard, count))
+            futures.append((indexes, future))
+        return futures
+
+
+    def complete(self, shard: int, count: int):
+        with self.lock:
+            self.completed[shard] += count
+
+
+    @staticmethod
+    def merge(size: int, parts: list) -> List[dict]:
+        results = [None] * size
+        for indexes, part in parts:
+            for index, result in zip(indexes, part):
+                results[index] = result
+        return results
+
+
+    def run(self, readings: List[dict]) -> List[dict]:
+        futures = self.submit(readings)
+        return self.merge(len(readings), [(indexes, future.result()) for indexes, future in futures])
+
+
+    async def run_async(self, readings: List[dict]) -> List[dict]:
+        futures = self.submit(readings)
+        parts = await asyncio.gather(*(asyncio.wrap_future(future) for _, future in futures))
+        return self.merge(len(readings), [(indexes, part) for (indexes, _), part in zip(futures, parts)])
+
+
+    def shutdown(self):
+        for executor in self.executors:
+            executor.shutdown(wait=True)
+
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                'shards': self.shards,
+                'submitted': list(self.submitted),
+                'pending': [submitted - completed for submitted, completed in zip(self.submitted, self.completed)]
+            }
@@ -10,3 +10,48 @@ def load_config():
 
 config = load_config()
 DATABASE_URL = config['database']['url']
+
+DATABASE_POOL_SIZE                = config.getint('database',     'pool_size',                fallback=5)
+DATABASE_MAX_OVERFLOW             = config.getint('database',     'max_overflow',             fallback=10)
+DATABASE_BACKGROUND_POOL_SIZE     = config.getint('database',     'background_pool_size',     fallback=2)
+DATABASE_BACKGROUND_MAX_OVERFLOW  = config.getint('database',     'background_max_overflow',  fallback=3)
+DATABASE_POOL_TIMEOUT             = config.getfloat('database',   'pool_timeout',             fallback=30)
+DATABASE_POOL_RECYCLE             = config.getint('database',     'pool_recycle',             fallback=3600)
+DATABASE_POOL_PRE_PING            = config.getboolean('database', 'pool_pre_ping',            fallback=True)
+DATABASE_ECHO                     = config.getboolean('database', 'echo',                     fallback=False)
+
+INGESTION_MODE           = config.get('ingestion',      'mode',           fallback='sync')
+INGESTION_QUEUE_SIZE     = config.getint('ingestion',   'queue_size',     fallback=10000)
+INGESTION_BATCH_SIZE     = config.getint('ingestion',   'batch_size',     fallback=500)
+INGESTION_FLUSH_INTERVAL = config.getfloat('ingestion', 'flush_interval', fallback=0.5)
+INGESTION_FLUSHERS       = config.getint('ingestion',   'flushers',       fallback=2)
+INGESTION_RETRY_AFTER    = config.getint('ingestion',   'retry_after',    fallback=1)
+INGESTION_STREAM_WINDOW  = config.getint('ingestion',   'stream_window',  fallback=10000)
+INGESTION_SHARDS         = config.getint('ingestion',   'shards',         fallback=0)
+
+SENSOR_CACHE_SIZE     = config.getint('cache',   'sensor_size',     fallback=10000)
+SENSOR_CACHE_TTL      = config.getfloat('cache', 'sensor_ttl',      fallback=30)
+ROOM_CACHE_SIZE       = config.getint('cache',   'room_size',       fallback=10000)
+RESPONSE_CACHE_SIZE   = config.getint('cache',   'response_size',   fallback=1000)
+RESPONSE_CACHE_TTL    = config.getfloat('cache', 'response_ttl',    fallback=60)
+CREDENTIAL_CACHE_SIZE = config.getint('cache',   'credential_size', fallback=10000)
+CREDENTIAL_CACHE_TTL  = config.getfloat('cache', 'credential_ttl',  fallback=60)
+
+RETENTION_ENABLED     = config.getboolean('retention', 'enabled',     fallback=True)
+RETENTION_HOUR        = config.getint('retention',     'hour',        fallback=24)
+RETENTION_CHUNK_SIZE  = config.getint('retention',     'chunk_size',  fallback=1000)
+RETENTION_PAUSE       = config.getfloat('retention',   'pause',       fallback=0.1)
+RETENTION_INTERVAL    = config.getint('retention',     'interval',    fallback=3600)
+RETENTION_CHANGE_DAYS = config.getint('retention',     'change_days', fallback=30)
+
+ROLLUP_MINUTE_DAYS = config.getint('rollup', 'minute_days', fallback=30)
+ROLLUP_HOUR_DAYS   = config.getint('rollup', 'hour_days',   fallback=365)
+
+LIVE_QUEUE_SIZE = config.getint('live', 'queue_size', fallback=1000)
+LIVE_HEARTBEAT  = config.getint('live', 'heartbeat',  fallback=15)
+
+AUTH_SECRET             = config.get('auth',      'secret',             fallback='')
+AUTH_TOKEN_TTL          = config.getint('auth',   'token_ttl',          fallback=900)
+AUTH_REVOCATION_REFRESH = config.getfloat('auth', 'revocation_refresh', fallback=5)
+
+HTTP_GZIP_MINIMUM_SIZE = config.getint('http', 'gzip_minimum_size', fallback=1000)
@@ -0,0 +1,94 @@
+"""
+Сравнение скорости сериализации списков показаний и событий:
+ORM-объекты + валидация pydantic + json (как было) против кортежей столбцов + FastJSONResponse.
+
+python -m tests.benchmark --count 100000 --repeat 5
+"""
+
+
+
+import gzip
+import json
+import time
+import argparse
+import sqlalchemy
+from typing import List
+from datetime import datetime, timedelta
+from pydantic import TypeAdapter
+from sqlalchemy import insert
+from services.CRUD import *
+from models.models_dto import IndicationDTO, EventDTO
+from services.database import get_session_fabric
+from services.serialization import rows_response, dto_columns, orjson
+
+
+
+def fill(db: Session, count: int):
+    create_company(db, "Компания", "Адрес")
+    create_room(db, 1, 1, "Помещение", "Описание")
+    create_sensor(db, 1, "Температура", True)
+
+    start = datetime(2024, 1, 1)
+    db.execute(insert(Indication), [{'sensor_id': 1, 'time': start + timedelta(seconds=i), 'value': 20.0 + i % 100 / 10,
+                                     'status': 'Нормальное'} for i in range(count)])
+    db.execute(insert(Event), [{'sensor_id': 1, 'time': start + timedelta(seconds=i), 'eliminated': True,
+                                'description': f'Показатель Температура = {45 + i % 10} > нормы (норма: 10-40)'} for i in range(count)])
+    db.commit()
+
+
+def before(db: Session, dto, get_objects) -> bytes:
+    # Путь FastAPI с response_model: валидация каждого объекта, перевод в JSON-совместимые типы, json.dumps
+    adapter = TypeAdapter(List[dto])
+    items = adapter.validate_python(get_objects(db, 1), from_attributes=True)
+    return json.dumps(adapter.dump_python(items, mode='json'), ensure_ascii=False, separators=(',', ':')).encode()
+
+
+def after(db: Session, dto, get_rows) -> bytes:
+    columns = dto_columns(dto)
+    return rows_response(columns, get_rows(db, 1, columns)).body
+
+
+def measure(func, db: Session, repeat: int, *args) -> tuple:
+    best, body = None, None
+    for _ in range(repeat):
+        db.expunge_all()
+        started = time.perf_counter()
+        body = func(db, *args)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, body
+
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сравнение скорости сериализации списков")
+    parser.add_argument('--count', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    engine = sqlalchemy.create_engine('sqlite:///:memory:')
+    Base.metadata.create_all(bind=engine)
+    db = get_session_fabric(engine)()
+    fill(db, args.count)
+
+    print(f"Объектов в списке: {args.count}, кодировщик: {'orjson' if orjson is not None else 'json'}")
+    print(f"{'Список':<12}{'Было, об/с':>14}{'Стало, об/с':>14}{'Ускорение':>12}{'JSON, КБ':>12}{'gzip, КБ':>12}")
+
+    cases = [
+        ('Показания', IndicationDTO, get_indications_by_sensor_id, get_indication_rows_by_sensor_id),
+        ('События',   EventDTO,      get_events_by_sensor_id,      get_event_rows_by_sensor_id),
+    ]
+    for name, dto, get_objects, get_rows in cases:
+        old_time, old_body = measure(before, db, args.repeat, dto, get_objects)
+        new_time, new_body = measure(after, db, args.repeat, dto, get_rows)
+        assert json.loads(old_body) == json.loads(new_body), f"Ответы для списка '{name}' различаются"
+
+        print(f"{name:<12}{args.count / old_time:>14,.0f}{args.count / new_time:>14,.0f}{old_time / new_time:>11.1f}x"
+              f"{len(new_body) / 1024:>12,.0f}{len(gzip.compress(new_body)) / 1024:>12,.0f}")
+
+    db.close()
+
+
+
+if __name__ == "__main__":
+    main()